@@ -0,0 +1,78 @@
+"""
+Compare accessing a MarkupField through its cached Markup with building a
+new Markup on every access.
+
+    python benchmarks/bench_access.py
+"""
+import argparse
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+if not settings.configured:
+    settings.configure(INSTALLED_APPS=["markupfield", "markupfield.tests"])
+    django.setup()
+
+from markupfield.fields import Markup  # noqa: E402
+from markupfield.tests.models import Post  # noqa: E402
+
+
+def new_markup(post):
+    # what MarkupDescriptor.__get__ did before the Markup was cached
+    return Markup(post, "body", "_body_rendered", "body_markup_type")
+
+
+def uncached_access(post):
+    # like a template using {{ post.body.raw }}, {{ post.body.rendered }}
+    # and {{ post.body }}
+    return new_markup(post).raw, new_markup(post).rendered, str(new_markup(post))
+
+
+def cached_access(post):
+    return post.body.raw, post.body.rendered, str(post.body)
+
+
+def allocated(get_markup, post, number):
+    # bytes held by the Markup objects of ``number`` accesses
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        markups = [get_markup(post) for _ in range(number)]  # noqa: F841
+        return tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+
+ACCESSES = [
+    ("uncached", uncached_access, new_markup),
+    ("cached", cached_access, lambda post: post.body),
+]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--number", type=int, default=100000)
+    args = parser.parse_args(argv)
+    post = Post(
+        title="post", body="*text*", body_markup_type="markdown", _body_rendered="x"
+    )
+    results = {}
+    for name, access, get_markup in ACCESSES:
+        seconds = min(timeit.repeat(lambda: access(post), number=args.number, repeat=3))
+        size = allocated(get_markup, post, 1000)
+        results[name] = {"seconds": seconds / args.number, "bytes_per_1000": size}
+        print(
+            "%-9s %8.3f us/access %8d bytes per 1000 accesses"
+            % (name, seconds / args.number * 1e6, size)
+        )
+    return results
+
+
+if __name__ == "__main__":
+    main()
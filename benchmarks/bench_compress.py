@@ -0,0 +1,91 @@
+"""
+Compare the size and fetch time of plain and compressed rendered columns.
+
+    python benchmarks/bench_compress.py
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+if not settings.configured:
+    settings.configure(
+        INSTALLED_APPS=["markupfield", "markupfield.tests"],
+        DATABASES={
+            "default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}
+        },
+    )
+    django.setup()
+
+from django.db import connection  # noqa: E402
+
+from markupfield.tests.models import CompressedPost, Post  # noqa: E402
+
+SECTION = """
+## Section %(n)d
+
+Some **strong** text, some *emphasis* and `literal` text with a
+[link](http://example.com/%(n)d).
+
+* a list item
+* another list item
+
+> a quote spanning
+> two lines
+"""
+
+DOCUMENT = "\n".join(SECTION % {"n": n} for n in range(40))
+
+
+def stored_size(model):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT SUM(LENGTH(CAST(_body_rendered AS BLOB))) FROM %s"
+            % model._meta.db_table
+        )
+        return cursor.fetchone()[0]
+
+
+def fetch(model):
+    return [post.body.rendered for post in model.objects.only("_body_rendered")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200)
+    parser.add_argument("--number", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    with connection.schema_editor() as editor:
+        editor.create_model(Post)
+        editor.create_model(CompressedPost)
+    Post.objects.bulk_create(
+        Post(title="post", body=DOCUMENT, body_markup_type="markdown")
+        for _ in range(args.rows)
+    )
+    CompressedPost.objects.bulk_create(
+        CompressedPost(body=DOCUMENT) for _ in range(args.rows)
+    )
+
+    results = {}
+    for name, model in [("plain", Post), ("compressed", CompressedPost)]:
+        assert fetch(model)[0] == fetch(Post)[0]
+        seconds = min(
+            timeit.repeat(lambda: fetch(model), number=args.number, repeat=3)
+        )
+        size = stored_size(model)
+        results[name] = {"bytes": size, "fetch_seconds": seconds / args.number}
+        print(
+            "%-11s %10d bytes %8.2f ms to fetch %d rows"
+            % (name, size, seconds / args.number * 1000, args.rows)
+        )
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Measure the cost of importing markupfield.markup.
+
+Each scenario runs in a fresh interpreter, the fastest of ``--repeat`` runs
+is reported along with the peak memory of the process:
+
+    python benchmarks/bench_import.py
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = [
+    ("python + django.utils.html", "import django.utils.html"),
+    ("import markupfield.markup", "import markupfield.markup"),
+    # what importing markupfield.markup cost when it imported the engines
+    (
+        "import markupfield.markup + engines (eager)",
+        "import markupfield.markup\n"
+        "import markdown, markdown.extensions.codehilite\n"
+        "import docutils.core, docutils.parsers.rst.directives\n"
+        "import pygments, pygments.formatters, pygments.lexers",
+    ),
+    # the engines are imported by the first render of each markup type
+    (
+        "import markupfield.markup + render each type",
+        "from django.conf import settings\n"
+        "settings.configure()\n"
+        "import markupfield.markup as m\n"
+        "for choice in m.DEFAULT_MARKUP_TYPES:\n"
+        "    choice[1]('Title\\n=====\\n\\n.. code:: python\\n\\n   x = 1\\n')",
+    ),
+]
+
+TEMPLATE = """
+import resource, time
+start = time.perf_counter()
+%s
+elapsed = time.perf_counter() - start
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def run(code, repeat):
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, "-c", TEMPLATE % code], cwd=ROOT
+        )
+        elapsed, maxrss = output.split()
+        timings.append((float(elapsed), int(maxrss)))
+    return min(timings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, code in SCENARIOS:
+        elapsed, maxrss = run(code, args.repeat)
+        results[name] = {"seconds": elapsed, "maxrss_kb": maxrss}
+        print("%-45s %8.1f ms %8d KiB" % (name, elapsed * 1000, maxrss))
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Compare markupfield's ReST renderer with a plain publish_parts call.
+
+    python benchmarks/bench_rest.py
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from django.conf import settings  # noqa: E402
+
+if not settings.configured:
+    settings.configure()
+
+from docutils.core import publish_parts  # noqa: E402
+
+from markupfield import markup  # noqa: E402
+from markupfield.markup import PYGMENTS_INSTALLED, RestRenderer  # noqa: E402
+
+SMALL = "A short *comment* with a `link <http://example.com>`_."
+
+SECTION = """
+Section %(n)d
+==========
+
+Some **strong** text, some *emphasis* and ``literal`` text with a
+`link <http://example.com/%(n)d>`_.
+
+* a list item
+* another list item
+
+  with a second paragraph
+
+.. note:: an admonition
+
+=====  =====
+col a  col b
+=====  =====
+1      2
+=====  =====
+"""
+
+LARGE = "\n".join(SECTION % {"n": n} for n in range(50))
+
+CODE_BLOCK = """
+.. code:: %(lexer)s
+
+   def f(x):
+       return x * 2
+
+"""
+
+CODE = "\n".join(
+    CODE_BLOCK % {"lexer": lexer}
+    for lexer in ["python", "javascript", "bash", "sql", "html", "rst"] * 10
+)
+
+DOCUMENTS = [("small", SMALL), ("large", LARGE), ("code", CODE)]
+
+
+def publish_parts_render(markup):
+    # what render_rest did before RestRenderer
+    overrides = {"raw_enabled": False, "file_insertion_enabled": False}
+    parts = publish_parts(
+        source=markup, writer_name="html4css1", settings_overrides=overrides
+    )
+    return parts["fragment"]
+
+
+def uncached_lexers_render(text, renderer=RestRenderer()):
+    # the code directive as it was before lexers and formatters were cached
+    get_lexer, get_formatter = markup._get_lexer, markup._get_formatter
+    markup._get_lexer = get_lexer.__wrapped__
+    markup._get_formatter = get_formatter.__wrapped__
+    try:
+        return renderer(text)
+    finally:
+        markup._get_lexer, markup._get_formatter = get_lexer, get_formatter
+
+
+def bench(renderers, documents, number):
+    results = {}
+    for doc_name, document in documents:
+        for name, render in renderers:
+            assert render(document)  # warm up, builds cached state
+            seconds = min(timeit.repeat(lambda: render(document), number=number, repeat=3))
+            per_call = seconds / number
+            results["%s/%s" % (doc_name, name)] = per_call
+            print("%-8s %-14s %10.3f ms" % (doc_name, name, per_call * 1000))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--number", type=int, default=20)
+    args = parser.parse_args(argv)
+    if PYGMENTS_INSTALLED:
+        # registers the pygments code directive
+        markup._load_rest()
+    renderers = [("publish_parts", publish_parts_render), ("RestRenderer", RestRenderer())]
+    results = bench(renderers, DOCUMENTS, args.number)
+    if PYGMENTS_INSTALLED:
+        renderers = [
+            ("uncached lexers", uncached_lexers_render),
+            ("cached lexers", RestRenderer()),
+        ]
+        results.update(bench(renderers, [("code", CODE)], args.number))
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""
+Benchmark renderers and MarkupField hot paths, optionally saving the
+results as JSON and comparing them with an earlier run.
+
+    python benchmarks/run.py --output before.json
+    # ... change something ...
+    python benchmarks/run.py --compare before.json
+
+Every result is the time of one operation in seconds, the fastest of
+``--repeat`` runs.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+if not settings.configured:
+    settings.configure(
+        INSTALLED_APPS=["markupfield", "markupfield.tests"],
+        DATABASES={
+            "default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}
+        },
+    )
+    django.setup()
+
+from django.db import connection  # noqa: E402
+
+from benchmarks import bench_import  # noqa: E402
+from markupfield.fields import MarkupField, _rendered_source_name  # noqa: E402
+from markupfield.markup import DEFAULT_MARKUP_TYPES  # noqa: E402
+from markupfield.tests.models import Post  # noqa: E402
+
+MARKDOWN_SECTION = """
+## Section %(n)d
+
+Some **strong** text, some *emphasis* and `literal` text with a
+[link](http://example.com/%(n)d).
+
+* a list item
+* another list item
+
+> a quote
+
+    :::python
+    def f(x):
+        return x * %(n)d
+"""
+
+REST_SECTION = """
+Section %(n)d
+============
+
+Some **strong** text, some *emphasis* and ``literal`` text with a
+`link <http://example.com/%(n)d>`_.
+
+* a list item
+* another list item
+
+.. note:: an admonition
+
+.. code:: python
+
+   def f(x):
+       return x * %(n)d
+"""
+
+TEXT_SECTION = """
+Paragraph %(n)d with a link to http://example.com/%(n)d and some text
+spanning a couple of lines, followed by <b>tags</b> & entities.
+"""
+
+SECTIONS = {
+    "markdown": MARKDOWN_SECTION,
+    "restructuredtext": REST_SECTION,
+    "html": TEXT_SECTION,
+    "plain": TEXT_SECTION,
+}
+
+# number of sections in each corpus size
+SIZES = [("small", 1), ("medium", 20), ("large", 500)]
+
+
+def corpus(markup_type, sections):
+    section = SECTIONS.get(markup_type, TEXT_SECTION)
+    return "\n".join(section % {"n": n} for n in range(sections))
+
+
+def measure(func, repeat):
+    # enough calls per run to take at least 0.2 seconds
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def bench_renderers(args):
+    results = {}
+    for markup_type, renderer, _ in DEFAULT_MARKUP_TYPES:
+        for size, sections in SIZES:
+            text = corpus(markup_type, sections)
+            renderer(text)  # warm up, e.g. imports the engine
+            results["render/%s/%s" % (markup_type, size)] = measure(
+                lambda: renderer(text), args.repeat
+            )
+    return results
+
+
+def bench_field(args):
+    text = corpus("markdown", 20)
+    post = Post(title="post", body=text, body_markup_type="markdown")
+    field = Post._meta.get_field("body")
+    source_name = _rendered_source_name("body")
+    field.pre_save(post, False)
+
+    def pre_save_render():
+        # forget what was rendered, as if the body changed
+        post.__dict__.pop(source_name, None)
+        field.pre_save(post, False)
+
+    return {
+        "pre_save/render": measure(pre_save_render, args.repeat),
+        "pre_save/unchanged": measure(lambda: field.pre_save(post, False), args.repeat),
+        "descriptor/get": measure(lambda: post.body, args.repeat),
+        "markup/str": measure(lambda: str(post.body), args.repeat),
+    }
+
+
+def bench_incremental(args):
+    # a large document changing one paragraph per save
+    text = corpus("markdown", 500)
+    results = {}
+    for name, incremental in [("full", False), ("incremental", True)]:
+        field = MarkupField(default_markup_type="markdown", incremental=incremental)
+        edits = iter(range(10**9))
+        field.render_markup(text, "markdown")
+
+        def edit():
+            raw = text.replace("a quote", "a quote %d" % next(edits), 1)
+            field.render_markup(raw, "markdown")
+
+        results["edit/%s" % name] = min(
+            timeit.repeat(edit, number=1, repeat=args.repeat)
+        )
+    return results
+
+
+def bench_bulk(args):
+    with connection.schema_editor() as editor:
+        editor.create_model(Post)
+    try:
+        text = corpus("markdown", 1)
+        posts = [
+            Post(
+                title="post %d" % n,
+                body="%s %d" % (text, n),
+                body_markup_type="markdown",
+            )
+            for n in range(args.rows)
+        ]
+
+        def save():
+            Post.objects.all().delete()
+            for post in posts:
+                post.pk = None
+                post._state.adding = True
+                post.__dict__.pop(_rendered_source_name("body"), None)
+            Post.objects.bulk_create(posts)
+
+        def load():
+            for post in Post.objects.all():
+                str(post.body)
+
+        save_seconds = min(timeit.repeat(save, number=1, repeat=args.repeat))
+        load_seconds = min(timeit.repeat(load, number=1, repeat=args.repeat))
+    finally:
+        with connection.schema_editor() as editor:
+            editor.delete_model(Post)
+    return {
+        "bulk/save_row": save_seconds / args.rows,
+        "bulk/load_row": load_seconds / args.rows,
+    }
+
+
+def bench_imports(args):
+    results = {}
+    for name, code in bench_import.SCENARIOS:
+        elapsed, _ = bench_import.run(code, args.repeat)
+        results["import/%s" % name] = elapsed
+    return results
+
+
+SUITES = [
+    ("renderers", bench_renderers),
+    ("field", bench_field),
+    ("incremental", bench_incremental),
+    ("bulk", bench_bulk),
+    ("import", bench_imports),
+]
+
+
+def environment():
+    versions = {"python": platform.python_version(), "django": django.get_version()}
+    for module in ["markdown", "docutils", "pygments"]:
+        try:
+            versions[module] = __import__(module).__version__
+        except (ImportError, AttributeError):
+            versions[module] = None
+    return versions
+
+
+def compare(results, previous):
+    for name, seconds in sorted(results.items()):
+        before = previous.get(name)
+        if before:
+            print(
+                "%-45s %12.6f ms %+8.1f%%"
+                % (name, seconds * 1000, (seconds / before - 1) * 100)
+            )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "suites",
+        nargs="*",
+        help="Suites to run, all by default: %s."
+        % ", ".join(name for name, _ in SUITES),
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--rows", type=int, default=500, help="Rows of the bulk suite.")
+    parser.add_argument("--output", help="Save the results to this JSON file.")
+    parser.add_argument("--compare", help="Compare with the results in this JSON file.")
+    args = parser.parse_args(argv)
+    unknown = set(args.suites) - set(name for name, _ in SUITES)
+    if unknown:
+        parser.error("unknown suites: %s" % ", ".join(sorted(unknown)))
+
+    results = {}
+    for name, suite in SUITES:
+        if args.suites and name not in args.suites:
+            continue
+        suite_results = suite(args)
+        for result, seconds in sorted(suite_results.items()):
+            print("%-45s %12.6f ms" % (result, seconds * 1000))
+        results.update(suite_results)
+
+    if args.compare:
+        with open(args.compare) as f:
+            print("\ncompared with %s:" % args.compare)
+            compare(results, json.load(f)["results"])
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "environment": environment(),
+                    "results": results,
+                },
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+    return results
+
+
+if __name__ == "__main__":
+    main()
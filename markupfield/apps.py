@@ -0,0 +1,15 @@
+from django.apps import AppConfig
+from django.conf import settings
+
+
+class MarkupFieldConfig(AppConfig):
+    name = "markupfield"
+    verbose_name = "MarkupField"
+
+    def ready(self):
+        # in preforking servers loading the application before forking, the
+        # workers share the warmed up engines
+        if getattr(settings, "MARKUP_FIELD_WARMUP", False):
+            from markupfield.registry import warmup
+
+            warmup()
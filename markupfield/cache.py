@@ -0,0 +1,326 @@
+import hashlib
+import threading
+import types
+from collections import OrderedDict
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from markupfield.markup import options_fingerprint
+
+# default size of the in-process cache in characters of rendered output
+DEFAULT_MAX_SIZE = 16 * 1024 * 1024
+# default size of the cache of previews
+DEFAULT_PREVIEW_MAX_SIZE = 4 * 1024 * 1024
+
+
+def renderer_identity(renderer):
+    """
+    Return a string identifying ``renderer`` across processes.
+
+    Renderers can declare a ``version`` attribute, changing it invalidates
+    everything they rendered before.  The arguments of partials are part of
+    the identity, see ``is_identifiable()`` for other configured renderers.
+    """
+    version = getattr(renderer, "version", "")
+    options = []
+    while isinstance(renderer, partial):
+        options.append([renderer.args, renderer.keywords])
+        renderer = renderer.func
+    name = getattr(renderer, "__qualname__", None) or type(renderer).__qualname__
+    identity = "%s.%s" % (getattr(renderer, "__module__", ""), name)
+    code = getattr(renderer, "__code__", None)
+    if code is not None and name.endswith("<lambda>"):
+        # lambdas of the same module can only be told apart by location
+        identity += ":%d" % code.co_firstlineno
+    if options:
+        identity += "(%s)" % options_fingerprint(options)
+    if version:
+        identity += "@%s" % version
+    return identity
+
+
+def is_identifiable(renderer):
+    """
+    Return True if ``renderer_identity()`` tells ``renderer`` apart from other
+    renderers: it declares a ``version`` or is a function without closure
+    variables, or a partial of one.  Instances and closures may be configured
+    in ways the identity doesn't see.
+    """
+    if getattr(renderer, "version", ""):
+        return True
+    while isinstance(renderer, partial):
+        renderer = renderer.func
+    return isinstance(
+        renderer, (types.FunctionType, types.BuiltinFunctionType)
+    ) and not getattr(renderer, "__closure__", None)
+
+
+class BaseRenderCache(object):
+    """
+    Cache of rendered markup keyed by the content it was rendered from.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._counter_lock = threading.Lock()
+
+    def accepts(self, renderer):
+        """
+        Return True if values rendered by ``renderer`` can be cached.
+        """
+        return True
+
+    def make_key(self, markup_type, escape_html, renderer, raw):
+        digest = hashlib.blake2b(raw.encode("utf-8"), digest_size=20).hexdigest()
+        return (markup_type, escape_html, renderer_identity(renderer), digest)
+
+    def get(self, key):
+        value = self._get(key)
+        with self._counter_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if value is not None:
+            self._set(key, value)
+
+    def get_many(self, keys):
+        """
+        Return a dict of the values found for ``keys``.
+        """
+        values = self._get_many(keys)
+        with self._counter_lock:
+            self.hits += len(values)
+            self.misses += len(keys) - len(values)
+        return values
+
+    def set_many(self, values):
+        self._set_many(
+            dict((key, value) for key, value in values.items() if value is not None)
+        )
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _set(self, key, value):
+        raise NotImplementedError
+
+    def _get_many(self, keys):
+        values = {}
+        for key in keys:
+            value = self._get(key)
+            if value is not None:
+                values[key] = value
+        return values
+
+    def _set_many(self, values):
+        for key, value in values.items():
+            self._set(key, value)
+
+
+class LRURenderCache(BaseRenderCache):
+    """
+    In-process cache evicting the least recently used values once the
+    rendered output it holds exceeds ``max_size`` characters.
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        super(LRURenderCache, self).__init__()
+        self.max_size = max_size
+        self.size = 0
+        self._data = OrderedDict()
+        self._renderers = {}
+        self._lock = threading.Lock()
+
+    def make_key(self, markup_type, escape_html, renderer, raw):
+        # within the process the renderer object itself tells renderers
+        # apart, it is kept alive so that its id isn't reused
+        self._renderers.setdefault(id(renderer), renderer)
+        digest = hashlib.blake2b(raw.encode("utf-8"), digest_size=20).hexdigest()
+        return (
+            markup_type,
+            escape_html,
+            id(renderer),
+            getattr(renderer, "version", ""),
+            digest,
+        )
+
+    def _get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def _set(self, key, value):
+        if len(value) > self.max_size:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._data[key] = value
+            self.size += len(value)
+            while self.size > self.max_size:
+                _, evicted = self._data.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def stats(self):
+        stats = super(LRURenderCache, self).stats()
+        stats.update(size=self.size, max_size=self.max_size, entries=len(self._data))
+        return stats
+
+
+class DjangoRenderCache(BaseRenderCache):
+    """
+    Cache backed by one of the caches in the ``CACHES`` setting, shared by
+    every process using it.
+    """
+
+    def __init__(self, alias="default"):
+        super(DjangoRenderCache, self).__init__()
+        self.alias = alias
+
+    def accepts(self, renderer):
+        # shared with other processes, which only know the identity
+        return is_identifiable(renderer)
+
+    def make_key(self, markup_type, escape_html, renderer, raw):
+        # keep keys short and free of characters memcached rejects
+        parts = super(DjangoRenderCache, self).make_key(
+            markup_type, escape_html, renderer, raw
+        )
+        return "markupfield:%s" % hashlib.blake2b(
+            repr(parts).encode("utf-8"), digest_size=20
+        ).hexdigest()
+
+    def _get(self, key):
+        return caches[self.alias].get(key)
+
+    def _set(self, key, value):
+        caches[self.alias].set(key, value)
+
+    def _get_many(self, keys):
+        return caches[self.alias].get_many(keys)
+
+    def _set_many(self, values):
+        caches[self.alias].set_many(values)
+
+    def clear(self):
+        caches[self.alias].clear()
+
+
+def get_fragment(markup):
+    """
+    Return the rendered value of ``markup``, a ``Markup``, through the
+    cache named by ``MARKUP_FIELD_FRAGMENT_CACHE`` (``'default'`` unless
+    set), keyed by ``markup.fingerprint``.  Cache hits don't load the rendered
+    value of fields with ``store_hash``.
+    """
+    fingerprint = markup.fingerprint
+    if fingerprint is None:
+        return markup.rendered
+    cache = caches[getattr(settings, "MARKUP_FIELD_FRAGMENT_CACHE", "default")]
+    key = "markupfield:fragment:%s" % hashlib.blake2b(
+        fingerprint.encode("utf-8"), digest_size=20
+    ).hexdigest()
+    rendered = cache.get(key)
+    if rendered is None:
+        rendered = markup.rendered
+        cache.set(key, rendered)
+    return rendered
+
+
+_render_cache = None
+_block_cache = None
+_preview_cache = None
+_render_cache_lock = threading.Lock()
+
+
+def get_render_cache():
+    """
+    Return the render cache configured by ``MARKUP_FIELD_RENDER_CACHE`` or
+    ``None`` if caching is disabled.
+    """
+    global _render_cache
+    if _render_cache is None:
+        backend = getattr(settings, "MARKUP_FIELD_RENDER_CACHE", None)
+        if not backend:
+            return None
+        with _render_cache_lock:
+            if _render_cache is None:
+                if backend == "lru":
+                    _render_cache = LRURenderCache(
+                        getattr(
+                            settings, "MARKUP_FIELD_RENDER_CACHE_SIZE", DEFAULT_MAX_SIZE
+                        )
+                    )
+                else:
+                    _render_cache = DjangoRenderCache(backend)
+    return _render_cache
+
+
+def get_block_cache(renderer=None):
+    """
+    Return the cache of blocks rendered by incremental renders: the render
+    cache if one is configured and accepts ``renderer``, an in-process LRU
+    cache otherwise.
+    """
+    global _block_cache
+    render_cache = get_render_cache()
+    if render_cache is not None and (
+        renderer is None or render_cache.accepts(renderer)
+    ):
+        return render_cache
+    if _block_cache is None:
+        with _render_cache_lock:
+            if _block_cache is None:
+                _block_cache = LRURenderCache(
+                    getattr(settings, "MARKUP_FIELD_RENDER_CACHE_SIZE", DEFAULT_MAX_SIZE)
+                )
+    return _block_cache
+
+
+def get_preview_cache():
+    """
+    Return the in-process LRU cache of previews rendered by
+    ``markupfield.views.preview``, holding ``MARKUP_FIELD_PREVIEW_CACHE_SIZE``
+    characters.
+    """
+    global _preview_cache
+    if _preview_cache is None:
+        with _render_cache_lock:
+            if _preview_cache is None:
+                _preview_cache = LRURenderCache(
+                    getattr(
+                        settings,
+                        "MARKUP_FIELD_PREVIEW_CACHE_SIZE",
+                        DEFAULT_PREVIEW_MAX_SIZE,
+                    )
+                )
+    return _preview_cache
+
+
+@receiver(setting_changed)
+def _reset_render_cache(setting, **kwargs):
+    global _render_cache, _block_cache, _preview_cache
+    if setting in ("MARKUP_FIELD_RENDER_CACHE", "MARKUP_FIELD_RENDER_CACHE_SIZE"):
+        _render_cache = _block_cache = None
+    elif setting == "MARKUP_FIELD_PREVIEW_CACHE_SIZE":
+        _preview_cache = None
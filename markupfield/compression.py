@@ -0,0 +1,50 @@
+import zlib
+from importlib.util import find_spec
+
+CODECS = ("zlib", "zstd")
+
+ZSTD_INSTALLED = find_spec("zstandard") is not None
+
+# compressed values start with a NUL byte, which text columns can't hold,
+# followed by the codec.  Anything else is UTF-8 text: short values that
+# aren't worth compressing and values written before compression was enabled.
+ZLIB_PREFIX = b"\x00z"
+ZSTD_PREFIX = b"\x00s"
+
+# values shorter than this many bytes are stored uncompressed
+MIN_SIZE = 128
+
+
+# codec of compress_rendered=True, the same wherever migrations are made
+DEFAULT_CODEC = "zlib"
+
+
+def compress(text, codec="zlib"):
+    """
+    Return ``text`` encoded and, unless it is short, compressed with
+    ``codec``.
+    """
+    data = text.encode("utf-8")
+    if len(data) < MIN_SIZE and not data.startswith(b"\x00"):
+        return data
+    if codec == "zstd":
+        import zstandard
+
+        return ZSTD_PREFIX + zstandard.ZstdCompressor().compress(data)
+    return ZLIB_PREFIX + zlib.compress(data)
+
+
+def decompress(data):
+    """
+    Return the text of a value written by ``compress()`` or stored as plain
+    UTF-8.
+    """
+    data = bytes(data)
+    prefix = data[:2]
+    if prefix == ZLIB_PREFIX:
+        data = zlib.decompress(data[2:])
+    elif prefix == ZSTD_PREFIX:
+        import zstandard
+
+        data = zstandard.ZstdDecompressor().decompress(data[2:])
+    return data.decode("utf-8")
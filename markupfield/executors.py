@@ -0,0 +1,72 @@
+import asyncio
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_render_executor():
+    """
+    Return the thread pool shared by everything rendering in the background.
+
+    Its size is taken from ``MARKUP_FIELD_RENDER_WORKERS``, by default the
+    ``concurrent.futures`` default is used.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, "MARKUP_FIELD_RENDER_WORKERS", None),
+                    thread_name_prefix="markupfield",
+                )
+    return _executor
+
+
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def get_async_executor():
+    """
+    Return the executor async renders run in: ``MARKUP_FIELD_ASYNC_EXECUTOR``
+    (a ``concurrent.futures.Executor`` or dotted path to one) or the shared
+    thread pool.
+    """
+    executor = getattr(settings, "MARKUP_FIELD_ASYNC_EXECUTOR", None)
+    if executor is None:
+        return get_render_executor()
+    if isinstance(executor, str):
+        executor = import_string(executor)
+    return executor
+
+
+def _get_semaphore(loop):
+    # semaphores belong to a loop, MARKUP_FIELD_ASYNC_CONCURRENCY is per loop
+    limit = getattr(settings, "MARKUP_FIELD_ASYNC_CONCURRENCY", None)
+    if limit is None:
+        return None
+    current_limit, semaphore = _semaphores.get(loop, (None, None))
+    if current_limit != limit:
+        semaphore = asyncio.Semaphore(limit)
+        _semaphores[loop] = (limit, semaphore)
+    return semaphore
+
+
+async def run_render(func, *args):
+    """
+    Run the blocking ``func(*args)`` in the async executor without blocking
+    the event loop, at most ``MARKUP_FIELD_ASYNC_CONCURRENCY`` at a time.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = _get_semaphore(loop)
+    call = partial(func, *args)
+    if semaphore is None:
+        return await loop.run_in_executor(get_async_executor(), call)
+    async with semaphore:
+        return await loop.run_in_executor(get_async_executor(), call)
@@ -1,22 +1,68 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from functools import partial
+
+from django.apps import apps
 from django.conf import settings
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import close_old_connections, models, router, transaction
+from django.db.models import signals
+from django.utils.module_loading import import_string
 from django.utils.safestring import mark_safe
 from django.utils.html import escape
 from django.utils.encoding import force_str
+from django.utils.text import Truncator
 
 from markupfield import widgets
 from markupfield import markup
+from markupfield import compression
+from markupfield.cache import get_block_cache, get_render_cache, renderer_identity
+from markupfield.executors import get_render_executor, run_render
+from markupfield.registry import renderers
+from markupfield.signals import markup_rendered
+from markupfield.stats import render_stats
+from markupfield.supervisor import RenderAborted, get_render_worker
 from django.contrib.admin.options import FORMFIELD_FOR_DBFIELD_DEFAULTS
 
 
 _rendered_field_name = lambda name: "_%s_rendered" % name  # noqa
 _markup_type_field_name = lambda name: "%s_markup_type" % name  # noqa
+_rendered_source_name = lambda name: "_%s_rendered_source" % name  # noqa
+_render_scheduled_name = lambda name: "_%s_render_scheduled" % name  # noqa
+_markup_cache_name = lambda name: "_%s_markup" % name  # noqa
+_text_field_name = lambda name: "_%s_text" % name  # noqa
+_excerpt_field_name = lambda name: "_%s_excerpt" % name  # noqa
+_version_field_name = lambda name: "_%s_version" % name  # noqa
+_hash_field_name = lambda name: "_%s_hash" % name  # noqa
+
+RENDER_MODES = ("immediate", "deferred")
+RENDER_FALLBACKS = ("escape", "raise")
+
+_escape_render = markup.PlainRenderer()
+
+logger = logging.getLogger("markupfield")
+
 
-# for fields that don't set markup_types: detected types or from settings
-_MARKUP_TYPES = getattr(settings, "MARKUP_FIELD_TYPES", markup.DEFAULT_MARKUP_TYPES)
+def rendered_hash(rendered):
+    """
+    Return the hash of a rendered value stored by ``store_hash``.
+    """
+    if rendered is None:
+        return None
+    return hashlib.blake2b(rendered.encode("utf-8"), digest_size=16).hexdigest()
 
 
 class Markup(object):
+    __slots__ = (
+        "instance",
+        "field_name",
+        "rendered_field_name",
+        "markup_type_field_name",
+    )
+
     def __init__(
         self, instance, field_name, rendered_field_name, markup_type_field_name
     ):
@@ -29,7 +75,11 @@ class Markup(object):
 
     # raw is read/write
     def _get_raw(self):
-        return self.instance.__dict__[self.field_name]
+        values = self.instance.__dict__
+        if self.field_name not in values:
+            # deferred with .defer()/.only()
+            self.instance._meta.get_field(self.field_name)._load_raw(self.instance)
+        return values[self.field_name]
 
     def _set_raw(self, val):
         setattr(self.instance, self.field_name, val)
@@ -38,19 +88,72 @@ class Markup(object):
 
     # markup_type is read/write
     def _get_markup_type(self):
-        return self.instance.__dict__[self.markup_type_field_name]
+        # deferred with .defer()/.only() unless loaded, Django loads it
+        return getattr(self.instance, self.markup_type_field_name)
 
     def _set_markup_type(self, val):
+        values = self.instance.__dict__
+        name = self.markup_type_field_name
+        if name not in values or values[name] != val:
+            field = self.instance._meta.get_field(self.field_name)
+            field._mark_rendered_stale(self.instance)
         return setattr(self.instance, self.markup_type_field_name, val)
 
     markup_type = property(_get_markup_type, _set_markup_type)
 
     # rendered is a read only property
     def _get_rendered(self):
-        return getattr(self.instance, self.rendered_field_name)
+        rendered = getattr(self.instance, self.rendered_field_name)
+        if rendered is None:
+            # a deferred render that hasn't happened yet, render it now
+            field = self.instance._meta.get_field(self.field_name)
+            if field.render_mode == "deferred" and self.raw is not None:
+                rendered = field.render_markup(
+                    self.raw, self.markup_type, self.instance
+                )
+                field._set_rendered(self.instance, rendered, self.markup_type)
+                field._remember_source(self.instance, self.raw, self.markup_type)
+        return rendered
 
     rendered = property(_get_rendered)
 
+    # text and excerpt are read only, see store_text and excerpt_length
+    @property
+    def text(self):
+        return getattr(self.instance, _text_field_name(self.field_name))
+
+    @property
+    def excerpt(self):
+        return getattr(self.instance, _excerpt_field_name(self.field_name))
+
+    @property
+    def fingerprint(self):
+        """
+        Identify the rendered value by model, primary key, field and hash of
+        the rendered value, ``None`` if there is none.  With ``store_hash``
+        the rendered value itself isn't loaded.
+        """
+        field = self.instance._meta.get_field(self.field_name)
+        if field.store_hash:
+            digest = getattr(self.instance, _hash_field_name(self.field_name))
+        else:
+            digest = rendered_hash(self.rendered)
+        if digest is None:
+            return None
+        return "%s:%s:%s:%s" % (
+            self.instance._meta.label,
+            self.instance.pk,
+            self.field_name,
+            digest,
+        )
+
+    async def arender(self):
+        """
+        Render without blocking the event loop and return the rendered value.
+        """
+        field = self.instance._meta.get_field(self.field_name)
+        return await field.arender(self.instance)
+
     # allows display via templates to work without safe filter
     def __str__(self):
         if self.rendered is None:
@@ -66,24 +169,93 @@ class MarkupDescriptor(object):
         self.field = field
         self.rendered_field_name = _rendered_field_name(self.field.name)
         self.markup_type_field_name = _markup_type_field_name(self.field.name)
+        self.cache_name = _markup_cache_name(self.field.name)
 
     def __get__(self, instance, owner):
         if instance is None:
             return self
-        return Markup(
-            instance,
-            self.field.name,
-            self.rendered_field_name,
-            self.markup_type_field_name,
-        )
+        # Markup reads everything from the instance, one per instance will do.
+        # copy.copy() of an instance copies the cache, hence the identity check.
+        markup = instance.__dict__.get(self.cache_name)
+        if markup is None or markup.instance is not instance:
+            markup = instance.__dict__[self.cache_name] = Markup(
+                instance,
+                self.field.name,
+                self.rendered_field_name,
+                self.markup_type_field_name,
+            )
+            if self.field.refresh_stale:
+                self.field._refresh_if_stale(instance)
+        return markup
 
     def __set__(self, obj, value):
+        if (
+            isinstance(value, Markup)
+            and value.instance is obj
+            and value.field_name == self.field.name
+        ):
+            # assigned its own value, e.g. by Model.full_clean()
+            return
+        obj.__dict__.pop(self.cache_name, None)
         if isinstance(value, Markup):
+            # the copied rendered value may not belong to our raw value
+            obj.__dict__.pop(_rendered_source_name(self.field.name), None)
             obj.__dict__[self.field.name] = value.raw
-            setattr(obj, self.rendered_field_name, value.rendered)
+            self.field._set_rendered(obj, value.rendered, value.markup_type)
             setattr(obj, self.markup_type_field_name, value.markup_type)
         else:
-            obj.__dict__[self.field.name] = value
+            # the same value again doesn't make the rendered value stale
+            values = obj.__dict__
+            if self.field.name not in values or values[self.field.name] != value:
+                self.field._mark_rendered_stale(obj)
+            values[self.field.name] = value
+
+
+class CompressedTextField(models.BinaryField):
+    """
+    Binary column holding text compressed with ``codec``, the value is a
+    ``str`` in Python.  Uncompressed UTF-8 in the column is read as well.
+    """
+
+    def __init__(self, *args, codec="zlib", **kwargs):
+        if codec not in compression.CODECS:
+            raise ValueError(
+                "Invalid codec (%s), allowed values: %s"
+                % (codec, ", ".join(compression.CODECS))
+            )
+        self.codec = codec
+        super(CompressedTextField, self).__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(CompressedTextField, self).deconstruct()
+        if self.codec != "zlib":
+            kwargs["codec"] = self.codec
+        return name, path, args, kwargs
+
+    def _check_str_default_value(self):
+        # defaults are text like the values
+        return []
+
+    def from_db_value(self, value, expression, connection):
+        # SQLite keeps text copied into the column by a migration as text
+        if value is None or isinstance(value, str):
+            return value
+        return compression.decompress(value)
+
+    def to_python(self, value):
+        if isinstance(value, (bytes, memoryview)):
+            return compression.decompress(value)
+        return value
+
+    def get_prep_value(self, value):
+        value = super(CompressedTextField, self).get_prep_value(value)
+        if isinstance(value, str):
+            return compression.compress(value, self.codec)
+        return value
+
+    def value_to_string(self, obj):
+        # serialized as text rather than base64 encoded bytes
+        return self.value_from_object(obj)
 
 
 class MarkupField(models.TextField):
@@ -93,8 +265,21 @@ class MarkupField(models.TextField):
         name=None,
         markup_type=None,
         default_markup_type=None,
-        markup_choices=_MARKUP_TYPES,
+        markup_choices=None,
         escape_html=False,
+        render_mode="immediate",
+        deferred_executor=None,
+        store_text=False,
+        excerpt_length=None,
+        compress_rendered=False,
+        max_raw_length=None,
+        render_timeout=None,
+        render_fallback="escape",
+        incremental=False,
+        store_version=False,
+        refresh_stale=False,
+        store_hash=False,
+        preview=False,
         **kwargs
     ):
 
@@ -107,6 +292,50 @@ class MarkupField(models.TextField):
         self.markup_type_editable = markup_type is None
         self.escape_html = escape_html
 
+        if render_mode not in RENDER_MODES:
+            raise ValueError(
+                "Invalid render_mode for field '%s', allowed values: %s"
+                % (name, ", ".join(RENDER_MODES))
+            )
+        self.render_mode = render_mode
+        self.deferred_executor = deferred_executor
+        self.store_text = store_text
+        self.excerpt_length = excerpt_length
+        if compress_rendered not in (True, False, None) + compression.CODECS:
+            raise ValueError(
+                "Invalid compress_rendered for field '%s', allowed values: "
+                "True, %s" % (name, ", ".join(compression.CODECS))
+            )
+        self.compress_rendered = compress_rendered
+
+        if render_fallback not in RENDER_FALLBACKS:
+            raise ValueError(
+                "Invalid render_fallback for field '%s', allowed values: %s"
+                % (name, ", ".join(RENDER_FALLBACKS))
+            )
+        self.max_raw_length = max_raw_length
+        self.render_timeout = render_timeout
+        self.render_fallback = render_fallback
+        self.incremental = incremental
+        if refresh_stale and not store_version:
+            raise ValueError(
+                "refresh_stale for field '%s' requires store_version" % name
+            )
+        self.store_version = store_version
+        self.refresh_stale = refresh_stale
+        self.store_hash = store_hash
+        self.preview = preview
+
+        if markup_choices is None:
+            # for fields that don't set markup_types: the registered types,
+            # read here so importing this module doesn't need the settings
+            markup_choices = renderers.choices()
+        else:
+            # names refer to registered types, sharing their renderers
+            markup_choices = [
+                renderers.choices([mc])[0] if isinstance(mc, str) else mc
+                for mc in markup_choices
+            ]
         self.markup_choices_list = [mc[0] for mc in markup_choices]
         self.markup_choices_dict = dict((mc[0], mc[1]) for mc in markup_choices)
         self.markup_choices_title = []
@@ -143,40 +372,532 @@ class MarkupField(models.TextField):
                 blank=False if self.default_markup_type else True,
                 null=False if self.default_markup_type else True,
             )
-            rendered_field = models.TextField(
-                editable=False, null=self.null, default=self.default
-            )
+            # deferred renders leave the rendered column NULL until they happen
+            rendered_null = self.null or self.render_mode == "deferred"
+            if self.compress_rendered:
+                codec = self.compress_rendered
+                if codec is True:
+                    codec = compression.DEFAULT_CODEC
+                rendered_field = CompressedTextField(
+                    codec=codec,
+                    editable=False,
+                    null=rendered_null,
+                    default=self.default,
+                )
+            else:
+                rendered_field = models.TextField(
+                    editable=False, null=rendered_null, default=self.default
+                )
             markup_type_field.creation_counter = self.creation_counter + 1
             rendered_field.creation_counter = self.creation_counter + 2
             cls.add_to_class(_markup_type_field_name(name), markup_type_field)
             cls.add_to_class(_rendered_field_name(name), rendered_field)
+            # text and excerpt of the rendered value, filled whenever it is
+            if self.store_text:
+                text_field = models.TextField(
+                    editable=False, blank=True, null=rendered_null, default=""
+                )
+                text_field.creation_counter = self.creation_counter + 3
+                cls.add_to_class(_text_field_name(name), text_field)
+            if self.excerpt_length:
+                excerpt_field = models.CharField(
+                    max_length=self.excerpt_length,
+                    editable=False,
+                    blank=True,
+                    null=rendered_null,
+                    default="",
+                )
+                excerpt_field.creation_counter = self.creation_counter + 4
+                cls.add_to_class(_excerpt_field_name(name), excerpt_field)
+            # existing rows get NULL, an unknown version is a stale one
+            if self.store_version:
+                version_field = models.CharField(
+                    max_length=32, editable=False, blank=True, null=True
+                )
+                version_field.creation_counter = self.creation_counter + 5
+                cls.add_to_class(_version_field_name(name), version_field)
+            if self.store_hash:
+                hash_field = models.CharField(
+                    max_length=32, editable=False, blank=True, null=True
+                )
+                hash_field.creation_counter = self.creation_counter + 6
+                cls.add_to_class(_hash_field_name(name), hash_field)
         super(MarkupField, self).contribute_to_class(cls, name)
 
         setattr(cls, self.name, MarkupDescriptor(self))
 
+        if self.rendered_field and not cls._meta.abstract:
+            self._connect_signals(cls)
+            # proxies and multi-table inheritance children send signals of
+            # their own
+            signals.class_prepared.connect(self._connect_subclass)
+
+    def _connect_signals(self, sender):
+        signals.post_init.connect(self._remember_loaded_source, sender=sender)
+        signals.post_save.connect(self._render_after_save, sender=sender)
+
+    def _connect_subclass(self, sender, **kwargs):
+        if sender is not self.model and issubclass(sender, self.model):
+            self._connect_signals(sender)
+
     def deconstruct(self):
         name, path, args, kwargs = super(MarkupField, self).deconstruct()
         # Don't migrate rendered fields
         kwargs["rendered_field"] = True
+        if self.store_text:
+            kwargs["store_text"] = True
+        if self.excerpt_length:
+            kwargs["excerpt_length"] = self.excerpt_length
+        if self.compress_rendered:
+            kwargs["compress_rendered"] = self.compress_rendered
+        if self.max_raw_length is not None:
+            kwargs["max_raw_length"] = self.max_raw_length
+        if self.render_timeout is not None:
+            kwargs["render_timeout"] = self.render_timeout
+        if self.render_fallback != "escape":
+            kwargs["render_fallback"] = self.render_fallback
+        if self.incremental:
+            kwargs["incremental"] = True
+        if self.store_version:
+            kwargs["store_version"] = True
+        if self.refresh_stale:
+            kwargs["refresh_stale"] = True
+        if self.store_hash:
+            kwargs["store_hash"] = True
+        if self.preview:
+            kwargs["preview"] = True
         return name, path, args, kwargs
 
     def pre_save(self, model_instance, add):
         value = super(MarkupField, self).pre_save(model_instance, add)
-        if value.markup_type not in self.markup_choices_list:
+        self._validate_markup_type(value.markup_type)
+        if self._is_rendered(model_instance, value.raw, value.markup_type):
+            if not self._is_render_pending(model_instance, value.raw):
+                return value.raw
+            # left out of the UPDATE, see _render_after_save()
+            if _rendered_field_name(self.attname) not in model_instance.__dict__:
+                return value.raw
+        if self.render_mode == "deferred" and value.raw is not None:
+            self._defer_render(model_instance, value.raw, value.markup_type)
+            return value.raw
+        rendered = self.render_markup(value.raw, value.markup_type, model_instance)
+        self._set_rendered(model_instance, rendered, value.markup_type)
+        self._remember_source(model_instance, value.raw, value.markup_type)
+        return value.raw
+
+    async def arender(self, instance):
+        """
+        Render the value of this field on ``instance`` in the async executor
+        and return it, a following ``asave()`` won't render it again.
+        """
+        value = getattr(instance, self.attname)
+        raw, markup_type = value.raw, value.markup_type
+        self._validate_markup_type(markup_type)
+        rendered_name = _rendered_field_name(self.attname)
+        if not self._is_rendered(
+            instance, raw, markup_type
+        ) or self._is_render_pending(instance, raw):
+            rendered = await run_render(self.render_markup, raw, markup_type, instance)
+            self._set_rendered(instance, rendered, markup_type)
+            self._remember_source(instance, raw, markup_type)
+        return getattr(instance, rendered_name)
+
+    def validate(self, value, model_instance):
+        super(MarkupField, self).validate(value, model_instance)
+        if self.render_fallback != "raise" or not isinstance(value, Markup):
+            return
+        raw, markup_type = value.raw, value.markup_type
+        if raw is None or markup_type not in self.markup_choices_list:
+            return
+        max_raw_length = self.get_max_raw_length(markup_type)
+        if max_raw_length is not None and len(raw) > max_raw_length:
+            raise self._raw_length_error(raw, max_raw_length)
+        # render now to report a timeout as a validation error, save() won't
+        # render again
+        if (
+            self.get_render_timeout(markup_type) is not None
+            and self.render_mode == "immediate"
+            and self.rendered_field
+            and model_instance is not None
+            and not self._is_rendered(model_instance, raw, markup_type)
+        ):
+            rendered = self.render_markup(raw, markup_type, model_instance)
+            self._set_rendered(model_instance, rendered, markup_type)
+            self._remember_source(model_instance, raw, markup_type)
+
+    def _validate_markup_type(self, markup_type):
+        if markup_type not in self.markup_choices_list:
             raise ValueError(
                 "Invalid markup type (%s), allowed values: %s"
-                % (value.markup_type, ", ".join(self.markup_choices_list))
+                % (markup_type, ", ".join(self.markup_choices_list))
             )
-        if value.raw is not None:
-            if self.escape_html:
-                raw = escape(value.raw)
-            else:
-                raw = value.raw
-            rendered = self.markup_choices_dict[value.markup_type](raw)
+
+    def render_markup(self, raw, markup_type, instance=None):
+        """
+        Render ``raw`` with the renderer this field uses for ``markup_type``.
+        ``instance`` is the model instance rendered for, if any.
+        """
+        instances = None if instance is None else [instance]
+        return self.render_markup_many([raw], markup_type, instances)[0]
+
+    def render_markup_many(self, raws, markup_type, instances=None):
+        """
+        Render each of ``raws`` with the renderer this field uses for
+        ``markup_type`` and return the results as a list.  ``instances``
+        holds the model instance of each value, if known.
+
+        Values not found in the render cache are rendered in one batch, see
+        ``markup.render_many()``.
+        """
+        raws = list(raws)
+        results = [None] * len(raws)
+        renderer = self.markup_choices_dict[markup_type]
+        render_cache = get_render_cache()
+        if render_cache is not None and not render_cache.accepts(renderer):
+            render_cache = None
+        max_raw_length = self.get_max_raw_length(markup_type)
+        pending = []
+        for index, raw in enumerate(raws):
+            if raw is None:
+                continue
+            if max_raw_length is not None and len(raw) > max_raw_length:
+                results[index] = self._render_fallback(
+                    raw, markup_type, self._raw_length_error(raw, max_raw_length)
+                )
+                continue
+            key = None
+            if render_cache is not None:
+                key = render_cache.make_key(
+                    markup_type, self.escape_html, renderer, raw
+                )
+                rendered = render_cache.get(key)
+                if rendered is not None:
+                    results[index] = rendered
+                    continue
+            pending.append((index, key))
+        if not pending:
+            return results
+
+        sources = (raws[index] for index, _ in pending)
+        if self.escape_html:
+            sources = map(escape, sources)
+        timeout = self.get_render_timeout(markup_type)
+        if timeout is not None:
+            rendered_values = self._render_supervised(markup_type, sources, timeout)
+        elif self.incremental:
+            rendered_values = self._render_incremental(renderer, markup_type, sources)
         else:
-            rendered = None
-        setattr(model_instance, _rendered_field_name(self.attname), rendered)
-        return value.raw
+            rendered_values = markup.render_many(renderer, sources)
+        # batches render lazily, each document is timed as it is produced
+        started = time.perf_counter()
+        for (index, key), rendered in zip(pending, rendered_values):
+            duration = time.perf_counter() - started
+            if isinstance(rendered, RenderAborted):
+                rendered = self._render_fallback(
+                    raws[index],
+                    markup_type,
+                    ValidationError(
+                        "Rendering this value as %(markup_type)s took too long.",
+                        code="render_timeout",
+                        params={"markup_type": markup_type},
+                    ),
+                    rendered,
+                )
+            elif key is not None:
+                render_cache.set(key, rendered)
+            results[index] = rendered
+            self._record_render(
+                instances[index] if instances is not None else None,
+                markup_type,
+                raws[index],
+                rendered,
+                duration,
+            )
+            started = time.perf_counter()
+        return results
+
+    def get_max_raw_length(self, markup_type):
+        if isinstance(self.max_raw_length, dict):
+            return self.max_raw_length.get(markup_type)
+        return self.max_raw_length
+
+    def get_render_timeout(self, markup_type):
+        if isinstance(self.render_timeout, dict):
+            return self.render_timeout.get(markup_type)
+        return self.render_timeout
+
+    def _raw_length_error(self, raw, max_raw_length):
+        return ValidationError(
+            "Ensure this value has at most %(limit_value)d characters "
+            "(it has %(show_value)d).",
+            code="max_raw_length",
+            params={"limit_value": max_raw_length, "show_value": len(raw)},
+        )
+
+    def _render_supervised(self, markup_type, sources, timeout):
+        # renders in this thread's worker process, aborted renders are
+        # yielded rather than raised to be handled per document
+        worker = get_render_worker()
+        for source in sources:
+            try:
+                yield worker.render(self, markup_type, source, timeout)
+            except RenderAborted as e:
+                yield e
+
+    def _render_incremental(self, renderer, markup_type, sources):
+        # joins the rendered blocks of each document, only blocks missing
+        # from the block cache are rendered
+        block_cache = get_block_cache(renderer)
+        for source in sources:
+            blocks = markup.split_blocks(renderer, source)
+            if not blocks:
+                yield renderer(source)
+                continue
+            keys = [
+                block_cache.make_key(markup_type, False, renderer, block)
+                for block in blocks
+            ]
+            rendered = block_cache.get_many(list(dict.fromkeys(keys)))
+            missing = dict(
+                (key, block) for key, block in zip(keys, blocks) if key not in rendered
+            )
+            if missing:
+                rendered.update(
+                    zip(missing, markup.render_many(renderer, missing.values()))
+                )
+                block_cache.set_many(dict((key, rendered[key]) for key in missing))
+            yield renderer.join_blocks([rendered[key] for key in keys])
+
+    def _render_fallback(self, raw, markup_type, error, cause=None):
+        if self.render_fallback == "raise":
+            raise error from cause
+        logger.warning(
+            "Rendering %s as %s failed, escaped instead: %s",
+            self.name,
+            markup_type,
+            cause or error.messages[0],
+        )
+        return _escape_render(raw)
+
+    def _record_render(self, instance, markup_type, raw, rendered, duration):
+        raw_size = len(raw.encode("utf-8"))
+        rendered_size = 0
+        if isinstance(rendered, str):
+            rendered_size = len(rendered.encode("utf-8"))
+        render_stats.record(markup_type, duration, raw_size, rendered_size)
+        model = getattr(self, "model", None)
+        threshold = getattr(settings, "MARKUP_FIELD_SLOW_RENDER_THRESHOLD", None)
+        if threshold is not None and duration >= threshold:
+            logger.warning(
+                "Slow render of %s (pk=%s) %s as %s: %.3fs for %d bytes",
+                model._meta.label if model is not None else None,
+                getattr(instance, "pk", None),
+                self.name,
+                markup_type,
+                duration,
+                raw_size,
+            )
+        markup_rendered.send(
+            sender=model,
+            field=self,
+            instance=instance,
+            markup_type=markup_type,
+            duration=duration,
+            raw_size=raw_size,
+            rendered_size=rendered_size,
+        )
+
+    def get_rendered_values(self, rendered, markup_type=None):
+        """
+        Return the values of the columns derived from ``rendered``, keyed by
+        column name: the rendered value itself and, if stored, the version of
+        the ``markup_type`` renderer, its hash, text and excerpt.
+        """
+        values = {_rendered_field_name(self.attname): rendered}
+        if self.store_version:
+            values[_version_field_name(self.attname)] = (
+                None if rendered is None else self.get_render_version(markup_type)
+            )
+        if self.store_hash:
+            values[_hash_field_name(self.attname)] = rendered_hash(rendered)
+        if self.store_text or self.excerpt_length:
+            text = None if rendered is None else markup.html_to_text(rendered)
+            if self.store_text:
+                values[_text_field_name(self.attname)] = text
+            if self.excerpt_length:
+                values[_excerpt_field_name(self.attname)] = (
+                    None if text is None else Truncator(text).chars(self.excerpt_length)
+                )
+        return values
+
+    def get_rendered_columns(self):
+        """
+        Return the names of the columns set by ``get_rendered_values()``.
+        """
+        return list(self.get_rendered_values(None))
+
+    def _set_rendered(self, instance, rendered, markup_type=None):
+        for name, value in self.get_rendered_values(rendered, markup_type).items():
+            setattr(instance, name, value)
+
+    def get_render_version(self, markup_type):
+        """
+        Return a fingerprint of the renderer of ``markup_type`` and its
+        ``version``, stored by ``store_version``.
+        """
+        identity = "%s:%s" % (
+            renderer_identity(self.markup_choices_dict[markup_type]),
+            self.escape_html,
+        )
+        return hashlib.blake2b(identity.encode("utf-8"), digest_size=8).hexdigest()
+
+    def get_stale_filter(self):
+        """
+        Return a ``Q`` matching the rows whose rendered value wasn't rendered
+        by the current version of their renderer, or of unknown version.
+        """
+        if not self.store_version:
+            raise ValueError(
+                "%s.%s doesn't store render versions, set store_version=True"
+                % (self.model.__name__, self.name)
+            )
+        markup_type_name = _markup_type_field_name(self.attname)
+        version_name = _version_field_name(self.attname)
+        condition = models.Q(pk__in=[])
+        for markup_type in self.markup_choices_list:
+            # NULL versions match the negated lookup as well
+            condition |= models.Q(**{markup_type_name: markup_type}) & ~models.Q(
+                **{version_name: self.get_render_version(markup_type)}
+            )
+        return condition & models.Q(**{self.attname + "__isnull": False})
+
+    def _refresh_if_stale(self, instance):
+        # refresh_stale: hand a row loaded with a stale rendered value to the
+        # deferred render executor, the loaded instance keeps its value
+        values = instance.__dict__
+        version_name = _version_field_name(self.attname)
+        markup_type = values.get(_markup_type_field_name(self.attname))
+        if (
+            instance._state.adding
+            # deferred, see defer_rendered()
+            or version_name not in values
+            or values.get(_rendered_field_name(self.attname)) is None
+            or markup_type not in self.markup_choices_dict
+            or values[version_name] == self.get_render_version(markup_type)
+        ):
+            return
+        using = instance._state.db or router.db_for_write(
+            type(instance), instance=instance
+        )
+        transaction.on_commit(
+            partial(self._schedule_render, instance, using), using=using
+        )
+
+    def _defer_render(self, instance, raw, markup_type):
+        # mark the rendered value stale, the render is scheduled once the row
+        # is written, see _render_after_save()
+        self._set_rendered(instance, None)
+        self._remember_source(instance, raw, markup_type)
+        instance.__dict__[_render_scheduled_name(self.attname)] = True
+
+    def _is_render_pending(self, instance, raw):
+        # saved with a deferred render that hasn't reached this instance
+        return (
+            self.render_mode == "deferred"
+            and raw is not None
+            and instance.__dict__.get(_rendered_field_name(self.attname)) is None
+        )
+
+    def _render_after_save(self, instance, using, **kwargs):
+        # post_save: the row exists, even in autocommit mode where on_commit()
+        # callbacks run right away
+        values = instance.__dict__
+        if values.pop(_render_scheduled_name(self.attname), False):
+            # unload the rendered columns: the render may finish any time,
+            # reading them loads what it stored and save() leaves them out
+            for name in self.get_rendered_columns():
+                values.pop(name, None)
+            transaction.on_commit(
+                partial(self._schedule_render, instance, using), using=using
+            )
+
+    def _schedule_render(self, instance, using):
+        executor = (
+            self.deferred_executor
+            or getattr(settings, "MARKUP_FIELD_DEFERRED_EXECUTOR", None)
+            or thread_pool_executor
+        )
+        if isinstance(executor, str):
+            executor = import_string(executor)
+        executor(self.model._meta.label, instance.pk, self.name, using)
+
+    def _load_raw(self, instance):
+        # the raw value was deferred, load it with a query of its own as
+        # refresh_from_db() would assign it through the descriptor, which
+        # also copies the rendered value and markup type.  The rendered source
+        # isn't remembered, the markup type may have been changed since.
+        manager = type(instance)._base_manager.db_manager(
+            instance._state.db, hints={"instance": instance}
+        )
+        instance.__dict__[self.attname] = (
+            manager.filter(pk=instance.pk).values_list(self.attname, flat=True).get()
+        )
+
+    def _mark_rendered_stale(self, instance):
+        # a save() of an instance loaded without its rendered columns only
+        # writes the loaded columns, load them as empty so that the values
+        # rendered in pre_save are written as well
+        if self.rendered_field and not instance._state.adding:
+            for name in self.get_rendered_columns():
+                if name not in instance.__dict__:
+                    instance.__dict__[name] = None
+
+    def _remember_loaded_source(self, instance, **kwargs):
+        # post_init: if the instance came with its rendered value (e.g. it was
+        # loaded from the database) remember which raw/markup_type produced it
+        values = instance.__dict__
+        markup_type_name = _markup_type_field_name(self.attname)
+        rendered_name = _rendered_field_name(self.attname)
+        if (
+            self.attname in values
+            and markup_type_name in values
+            and rendered_name in values
+            # not rendered yet, see render_mode="deferred"
+            and (values[rendered_name] is not None or values[self.attname] is None)
+        ):
+            self._remember_source(
+                instance, values[self.attname], values[markup_type_name], False
+            )
+
+    def _remember_source(self, instance, raw, markup_type, rendered=True):
+        # a reference to raw is kept instead of a hash: it costs nothing on
+        # load and comparing against an unchanged value is an identity check.
+        # The rendered value is kept as well, assigning another one (e.g. by
+        # refresh_from_db()) makes the source unknown.
+        instance.__dict__[_rendered_source_name(self.attname)] = (
+            raw,
+            markup_type,
+            rendered,
+            instance.__dict__.get(_rendered_field_name(self.attname)),
+        )
+
+    def _is_rendered(self, instance, raw, markup_type):
+        """
+        Return True if the rendered value on ``instance`` was produced from
+        ``raw`` and ``markup_type`` and hasn't been replaced since.
+
+        Sources captured in post_init are only trusted for instances that were
+        loaded from the database, new instances carry the rendered default.
+        """
+        source = instance.__dict__.get(_rendered_source_name(self.attname))
+        if source is None:
+            return False
+        return (
+            source[0] == raw
+            and source[1] == markup_type
+            and (source[2] or not instance._state.adding)
+            and instance.__dict__.get(_rendered_field_name(self.attname)) is source[3]
+        )
 
     def get_prep_value(self, value):
         if isinstance(value, Markup):
@@ -188,6 +909,8 @@ class MarkupField(models.TextField):
         # Wagtail checks for existence of this method to determine what
         # value to index in its search backend. Incoming value comes from
         # model_instance.field_name
+        if self.store_text and isinstance(value, Markup):
+            return value.text
         return self.get_prep_value(value)
 
     def value_to_string(self, obj):
@@ -202,6 +925,15 @@ class MarkupField(models.TextField):
     def formfield(self, **kwargs):
         defaults = {"widget": widgets.MarkupTextarea}
         defaults.update(kwargs)
+        widget = defaults["widget"]
+        if (
+            self.preview
+            and isinstance(widget, type)
+            and issubclass(widget, widgets.MarkupTextarea)
+        ):
+            defaults["widget"] = widget(
+                preview_field="%s.%s" % (self.model._meta.label, self.name)
+            )
         return super(MarkupField, self).formfield(**defaults)
 
     def to_python(self, value):
@@ -211,6 +943,220 @@ class MarkupField(models.TextField):
             return super(MarkupField, self).to_python(value)
 
 
+def get_markup_fields(model, field_names=None):
+    """
+    Return the MarkupFields of ``model`` that store a rendered value,
+    restricted to ``field_names`` if given.
+    """
+    return [
+        field
+        for field in model._meta.concrete_fields
+        if isinstance(field, MarkupField)
+        and field.rendered_field
+        and (field_names is None or field.name in field_names)
+    ]
+
+
+def _render_markup_many(field, raws, markup_type, instances):
+    # module level so process pools can pickle it
+    return field.render_markup_many(raws, markup_type, instances)
+
+
+def _chunks(items, size):
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def render_instances(instances, field_names=None, executor=None):
+    """
+    Render the MarkupFields of ``instances`` whose raw value or markup type
+    changed since they were rendered, e.g. before ``bulk_create()``.
+
+    Values are rendered in batches per field and markup type.
+    ``field_names`` restricts the fields rendered.  Batches run in
+    ``executor`` (any ``concurrent.futures.Executor``) if given.
+    """
+    pending = {}
+    for instance in instances:
+        for field in get_markup_fields(type(instance), field_names):
+            value = getattr(instance, field.attname)
+            raw, markup_type = value.raw, value.markup_type
+            field._validate_markup_type(markup_type)
+            if not field._is_rendered(instance, raw, markup_type):
+                pending.setdefault((field, markup_type), []).append((instance, raw))
+    if not pending:
+        return
+
+    batches = []
+    for (field, markup_type), items in pending.items():
+        if executor is None:
+            batches.append((field, markup_type, items))
+        else:
+            # split batches so that every worker gets a share
+            size = max(1, sum(map(len, pending.values())) // 32)
+            batches.extend(
+                (field, markup_type, chunk) for chunk in _chunks(items, size)
+            )
+    args = (
+        [field for field, _, _ in batches],
+        [[raw for _, raw in items] for _, _, items in batches],
+        [markup_type for _, markup_type, _ in batches],
+        [[instance for instance, _ in items] for _, _, items in batches],
+    )
+    if executor is None:
+        results = map(_render_markup_many, *args)
+    else:
+        results = executor.map(_render_markup_many, *args)
+    for (field, markup_type, items), rendered_values in zip(batches, results):
+        for (instance, raw), rendered in zip(items, rendered_values):
+            field._set_rendered(instance, rendered, markup_type)
+            field._remember_source(instance, raw, markup_type)
+
+
+class MarkupRenderError(Exception):
+    """
+    Rendering MarkupFields of an instance failed, ``errors`` maps the name of
+    each field that failed to the exception its render raised.
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        super(MarkupRenderError, self).__init__(
+            "Rendering failed for %s"
+            % "; ".join("%s: %s" % (name, error) for name, error in errors.items())
+        )
+
+
+def render_fields(instance, field_names=None, executor=None):
+    """
+    Render the MarkupFields of ``instance`` whose raw value or markup type
+    changed at the same time, in ``executor`` (by default the shared thread
+    pool, see ``MARKUP_FIELD_RENDER_WORKERS``).  ``field_names`` restricts
+    the fields rendered, fields with ``render_mode="deferred"`` are left to
+    ``pre_save``.
+
+    Fields that rendered are set even if others failed, then
+    ``MarkupRenderError`` is raised for the failed ones.
+    """
+    pending = []
+    errors = {}
+    for field in get_markup_fields(type(instance), field_names):
+        if field.render_mode != "immediate":
+            continue
+        value = getattr(instance, field.attname)
+        raw, markup_type = value.raw, value.markup_type
+        try:
+            field._validate_markup_type(markup_type)
+        except ValueError as e:
+            errors[field.name] = e
+            continue
+        if not field._is_rendered(instance, raw, markup_type):
+            pending.append((field, raw, markup_type))
+
+    parallel = len(pending) > 1
+    if parallel and executor is None:
+        # a thread of the pool waiting for the pool could wait forever
+        if threading.current_thread().name.startswith("markupfield"):
+            parallel = False
+        else:
+            executor = get_render_executor()
+    if parallel:
+        calls = [
+            executor.submit(
+                _render_markup_many, field, [raw], markup_type, [instance]
+            ).result
+            for field, raw, markup_type in pending
+        ]
+    else:
+        calls = [
+            partial(_render_markup_many, field, [raw], markup_type, [instance])
+            for field, raw, markup_type in pending
+        ]
+    for (field, raw, markup_type), call in zip(pending, calls):
+        try:
+            rendered = call()
+        except Exception as e:
+            errors[field.name] = e
+            continue
+        field._set_rendered(instance, rendered[0], markup_type)
+        field._remember_source(instance, raw, markup_type)
+    if errors:
+        raise MarkupRenderError(errors)
+
+
+class ParallelRenderMixin(object):
+    """
+    Model mixin rendering all changed MarkupFields of an instance at the same
+    time before it is saved, rather than one after another in ``pre_save``.
+    ``markup_render_executor`` is the executor used, the shared thread pool
+    unless set.
+    """
+
+    markup_render_executor = None
+
+    def save_base(self, *args, **kwargs):
+        if not kwargs.get("raw"):
+            render_fields(
+                self, kwargs.get("update_fields"), self.markup_render_executor
+            )
+        return super(ParallelRenderMixin, self).save_base(*args, **kwargs)
+
+
+async def arender_instances(instances, field_names=None):
+    """
+    Render the MarkupFields of ``instances`` concurrently in the async
+    executor, e.g. before ``abulk_create()``.  ``field_names`` restricts the
+    fields rendered.
+    """
+    renders = []
+    for instance in instances:
+        for field in get_markup_fields(type(instance), field_names):
+            renders.append(field.arender(instance))
+    await asyncio.gather(*renders)
+
+
+def render_deferred(model_label, pk, field_name, using=None):
+    """
+    Render and store the value of a ``render_mode="deferred"`` field.
+
+    Executors, e.g. a task queue, call this with the arguments they were
+    given.  The row is only updated if its raw value and markup type are
+    still the ones that were rendered.
+    """
+    model = apps.get_model(model_label)
+    field = model._meta.get_field(field_name)
+    markup_type_name = _markup_type_field_name(field.attname)
+    queryset = model._base_manager.using(using).filter(pk=pk)
+    row = queryset.values_list(field.attname, markup_type_name).first()
+    if row is None:
+        return
+    raw, markup_type = row
+    # only the primary key of the instance is known
+    rendered = field.render_markup(raw, markup_type, model(pk=pk))
+    queryset.filter(**{field.attname: raw, markup_type_name: markup_type}).update(
+        **field.get_rendered_values(rendered, markup_type)
+    )
+
+
+def _render_deferred_in_thread(*args):
+    # like a request: connections are thread local and closed when unusable
+    close_old_connections()
+    try:
+        render_deferred(*args)
+    except Exception:
+        logger.exception("Deferred render of %s (pk=%s) %s failed", *args[:3])
+    finally:
+        close_old_connections()
+
+
+def thread_pool_executor(model_label, pk, field_name, using):
+    """
+    Default executor for deferred renders, renders in a shared thread pool.
+    """
+    get_render_executor().submit(
+        _render_deferred_in_thread, model_label, pk, field_name, using
+    )
+
+
 # register MarkupField to use the custom widget in the Admin
 FORMFIELD_FOR_DBFIELD_DEFAULTS[MarkupField] = {
     "widget": widgets.AdminMarkupTextareaWidget
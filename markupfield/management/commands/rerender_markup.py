@@ -0,0 +1,227 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from markupfield.fields import MarkupField, _markup_type_field_name
+from markupfield.supervisor import setup_worker
+
+
+def _render_rows(field, rows):
+    # rows are rendered in one batch per markup type
+    by_markup_type = {}
+    for pk, raw, markup_type in rows:
+        by_markup_type.setdefault(markup_type, []).append((pk, raw))
+    results = []
+    for markup_type, items in by_markup_type.items():
+        rendered = field.render_markup_many(
+            [raw for _, raw in items],
+            markup_type,
+            # only the primary keys of the instances are known
+            [field.model(pk=pk) for pk, _ in items],
+        )
+        results.extend(
+            (pk, tuple(field.get_rendered_values(value, markup_type).values()))
+            for (pk, _), value in zip(items, rendered)
+        )
+    return results
+
+
+def _split(rows, parts):
+    return [rows[n::parts] for n in range(min(parts, len(rows)))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-render the stored HTML of MarkupFields, e.g. after a renderer or "
+        "RESTRUCTUREDTEXT_FILTER_SETTINGS changed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "labels",
+            nargs="*",
+            metavar="app_label[.ModelName]",
+            help="Restrict re-rendering to the given apps or models.",
+        )
+        parser.add_argument(
+            "--field",
+            action="append",
+            dest="fields",
+            help="Only re-render the named MarkupField (can be repeated).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of rows fetched, rendered and written at a time.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=0,
+            help="Render in a pool of this many processes (default: render inline).",
+        )
+        parser.add_argument(
+            "--start-after",
+            help="Resume after this primary key, as reported by a previous run.",
+        )
+        parser.add_argument(
+            "--stale-only",
+            action="store_true",
+            help=(
+                "Only re-render rows rendered by another renderer version, of "
+                "MarkupFields with store_version."
+            ),
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help=(
+                "Write every row, even unchanged ones, e.g. to compress existing "
+                "rows after enabling compress_rendered."
+            ),
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Render and report changed rows without writing them.",
+        )
+        parser.add_argument(
+            "--database",
+            default=DEFAULT_DB_ALIAS,
+            help='Database to re-render. Defaults to the "default" database.',
+        )
+
+    def handle(self, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be a positive integer.")
+        targets = self.get_targets(
+            options["labels"], options["fields"], options["stale_only"]
+        )
+        if options["start_after"] is not None and len(targets) > 1:
+            raise CommandError(
+                "--start-after requires a single model and field, found: %s"
+                % ", ".join(self.target_name(m, f) for m, f in targets)
+            )
+
+        executor = None
+        if options["workers"] > 1:
+            executor = ProcessPoolExecutor(
+                max_workers=options["workers"], initializer=setup_worker
+            )
+        try:
+            for model, field in targets:
+                self.rerender(model, field, executor, **options)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    def get_targets(self, labels, field_names, stale_only=False):
+        if labels:
+            models = []
+            for label in labels:
+                try:
+                    if "." in label:
+                        models.append(apps.get_model(label))
+                    else:
+                        models.extend(apps.get_app_config(label).get_models())
+                except LookupError as e:
+                    raise CommandError(str(e))
+        else:
+            models = apps.get_models()
+
+        targets = []
+        for model in models:
+            if model._meta.proxy:
+                continue
+            for field in model._meta.local_fields:
+                if not isinstance(field, MarkupField) or not field.rendered_field:
+                    continue
+                if field_names and field.name not in field_names:
+                    continue
+                if stale_only and not field.store_version:
+                    continue
+                targets.append((model, field))
+        if not targets:
+            if stale_only:
+                raise CommandError(
+                    "No MarkupFields with store_version found to re-render."
+                )
+            raise CommandError("No MarkupFields found to re-render.")
+        return targets
+
+    def target_name(self, model, field):
+        return "%s.%s" % (model._meta.label, field.name)
+
+    def rerender(self, model, field, executor, **options):
+        columns = field.get_rendered_columns()
+        queryset = model._base_manager.using(options["database"]).filter(
+            **{_markup_type_field_name(field.name) + "__in": field.markup_choices_list}
+        )
+        if options["stale_only"]:
+            queryset = queryset.filter(field.get_stale_filter())
+        if options["start_after"] is not None:
+            queryset = queryset.filter(pk__gt=options["start_after"])
+        rows = queryset.order_by("pk").values_list(
+            "pk", field.name, _markup_type_field_name(field.name), *columns
+        )
+        rows = rows.iterator(chunk_size=options["batch_size"])
+
+        name = self.target_name(model, field)
+        total = changed = 0
+        started = time.monotonic()
+        while True:
+            batch = list(islice(rows, options["batch_size"]))
+            if not batch:
+                break
+            current = {row[0]: row[3:] for row in batch}
+            batch = [row[:3] for row in batch]
+            if executor is None:
+                results = _render_rows(field, batch)
+            else:
+                results = []
+                for part in executor.map(
+                    _render_rows,
+                    [field] * options["workers"],
+                    _split(batch, options["workers"]),
+                ):
+                    results.extend(part)
+
+            objs = [
+                model(pk=pk, **dict(zip(columns, values)))
+                for pk, values in results
+                if options["force"] or values != current[pk]
+            ]
+            if objs and not options["dry_run"]:
+                model._base_manager.using(options["database"]).bulk_update(
+                    objs, columns
+                )
+
+            total += len(batch)
+            changed += len(objs)
+            if options["verbosity"] >= 2:
+                self.stdout.write(
+                    "%s: %d rows rendered, %d changed (last pk %s, %.1f rows/s)"
+                    % (name, total, changed, batch[-1][0], self.rate(total, started))
+                )
+
+        if options["verbosity"] >= 1:
+            self.stdout.write(
+                "%s: %d rows rendered, %d %s in %.2fs (%.1f rows/s)"
+                % (
+                    name,
+                    total,
+                    changed,
+                    "would change" if options["dry_run"] else "changed",
+                    time.monotonic() - started,
+                    self.rate(total, started),
+                )
+            )
+
+    def rate(self, count, started):
+        elapsed = time.monotonic() - started
+        return count / elapsed if elapsed else 0.0
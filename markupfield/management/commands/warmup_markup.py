@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from markupfield.registry import warmup
+
+
+class Command(BaseCommand):
+    help = (
+        "Warm up the renderers of MarkupFields and report how long each took, "
+        "e.g. to check what MARKUP_FIELD_WARMUP saves the first render."
+    )
+
+    def handle(self, **options):
+        for name, renderer, seconds in warmup():
+            self.stdout.write("%-20s %8.1f ms  %r" % (name, seconds * 1000, renderer))
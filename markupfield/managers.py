@@ -0,0 +1,219 @@
+from django.db import connections, models, transaction
+
+from markupfield.fields import (
+    get_markup_fields,
+    render_instances,
+    _hash_field_name,
+    _markup_type_field_name,
+    _rendered_field_name,
+)
+
+
+class MarkupQuerySetMixin(object):
+    """
+    QuerySet mixin keeping rendered MarkupField values up to date in
+    ``bulk_create()``, ``bulk_update()`` and ``update()``, with
+    ``defer_raw()`` and ``defer_rendered()`` to load part of a MarkupField
+    and ``stale_markup()`` to find values rendered by older renderers.
+    """
+
+    def defer_raw(self, *field_names):
+        """
+        Load only the rendered value of the named MarkupFields (all of them
+        by default), deferring their raw value and markup type.
+        """
+        return self.defer(
+            *[
+                name
+                for field in self._get_markup_fields(field_names)
+                for name in (field.name, _markup_type_field_name(field.name))
+            ]
+        )
+
+    def defer_rendered(self, *field_names):
+        """
+        Load only the raw value and markup type of the named MarkupFields
+        (all of them by default), deferring their rendered value, text and
+        excerpt.  Hashes stay loaded, see ``Markup.fingerprint``.
+        """
+        return self.defer(
+            *[
+                name
+                for field in self._get_markup_fields(field_names)
+                for name in field.get_rendered_columns()
+                if name != _hash_field_name(field.name)
+            ]
+        )
+
+    def stale_markup(self, *field_names):
+        """
+        Return the rows in which any of the named MarkupFields (all those with
+        ``store_version`` by default) was rendered by another version of its
+        renderer, or by an unknown one.
+        """
+        markup_fields = self._get_markup_fields(field_names)
+        if not field_names:
+            markup_fields = [field for field in markup_fields if field.store_version]
+            if not markup_fields:
+                raise ValueError(
+                    "%s has no MarkupField storing render versions"
+                    % self.model.__name__
+                )
+        condition = models.Q(pk__in=[])
+        for field in markup_fields:
+            condition |= field.get_stale_filter()
+        return self.filter(condition)
+
+    def _get_markup_fields(self, field_names):
+        markup_fields = get_markup_fields(self.model, field_names or None)
+        unknown = set(field_names) - set(field.name for field in markup_fields)
+        if unknown:
+            raise ValueError(
+                "%s has no MarkupField named %s"
+                % (self.model.__name__, ", ".join(sorted(unknown)))
+            )
+        return markup_fields
+
+    def bulk_create(self, objs, *args, executor=None, **kwargs):
+        # pre_save would render one object after another, render them up
+        # front when they can be rendered in parallel
+        objs = list(objs)
+        if executor is not None:
+            render_instances(objs, executor=executor)
+        deferred = [
+            field.name
+            for field in get_markup_fields(self.model)
+            if field.render_mode == "deferred"
+        ]
+        if deferred and not self._returns_pks(args, kwargs):
+            # rows inserted without their primary key can't be rendered later
+            render_instances(
+                [obj for obj in objs if obj.pk is None], deferred, executor=executor
+            )
+        objs = super(MarkupQuerySetMixin, self).bulk_create(objs, *args, **kwargs)
+        # bulk_create() sends no post_save, schedule deferred renders here
+        for field in get_markup_fields(self.model, deferred):
+            for obj in objs:
+                if obj.pk is not None:
+                    field._render_after_save(obj, self.db)
+        return objs
+
+    def _returns_pks(self, args, kwargs):
+        # bulk_create(objs, batch_size, ignore_conflicts, update_conflicts, ...)
+        conflicts = list(args[1:3]) + [
+            kwargs.get("ignore_conflicts"),
+            kwargs.get("update_conflicts"),
+        ]
+        return (
+            connections[self.db].features.can_return_rows_from_bulk_insert
+            and not any(conflicts)
+        )
+
+    def bulk_update(self, objs, fields, *args, executor=None, **kwargs):
+        objs = list(objs)
+        fields = list(fields)
+        markup_fields = get_markup_fields(self.model, fields)
+        if markup_fields:
+            render_instances(
+                objs, [field.name for field in markup_fields], executor=executor
+            )
+            for field in markup_fields:
+                names = [_markup_type_field_name(field.name)]
+                names.extend(field.get_rendered_columns())
+                for name in names:
+                    if name not in fields:
+                        fields.append(name)
+        return super(MarkupQuerySetMixin, self).bulk_update(
+            objs, fields, *args, **kwargs
+        )
+
+    bulk_update.alters_data = True
+
+    def update(self, **kwargs):
+        markup_fields = [
+            field
+            for field in get_markup_fields(self.model)
+            if (
+                field.name in kwargs
+                or _markup_type_field_name(field.name) in kwargs
+            )
+            and _rendered_field_name(field.name) not in kwargs
+        ]
+        if not markup_fields:
+            return super(MarkupQuerySetMixin, self).update(**kwargs)
+
+        with transaction.atomic(using=self.db, savepoint=False):
+            # rows are rendered per markup type or, when only the markup type
+            # changes, per row
+            rerender_rows = {}
+            groups = [(self, kwargs)]
+            for field in markup_fields:
+                markup_type_name = _markup_type_field_name(field.name)
+                if field.name not in kwargs:
+                    rerender_rows[field] = list(
+                        self.values_list("pk", field.attname)
+                    )
+                    continue
+                raw = kwargs[field.name]
+                if hasattr(raw, "resolve_expression"):
+                    raise ValueError(
+                        "Cannot render expression %r for '%s', update the rendered "
+                        "value explicitly or use bulk_update()." % (raw, field.name)
+                    )
+                if markup_type_name in kwargs:
+                    markup_types = [kwargs[markup_type_name]]
+                else:
+                    markup_types = list(
+                        self.order_by()
+                        .values_list(markup_type_name, flat=True)
+                        .distinct()
+                    )
+                rendered = {}
+                for markup_type in markup_types:
+                    field._validate_markup_type(markup_type)
+                    rendered[markup_type] = field.get_rendered_values(
+                        field.render_markup(raw, markup_type), markup_type
+                    )
+
+                split_groups = []
+                for queryset, values in groups:
+                    for markup_type in markup_types:
+                        group_values = dict(values)
+                        group_values.update(rendered[markup_type])
+                        if len(markup_types) > 1:
+                            split_groups.append(
+                                (
+                                    queryset.filter(**{markup_type_name: markup_type}),
+                                    group_values,
+                                )
+                            )
+                        else:
+                            split_groups.append((queryset, group_values))
+                groups = split_groups
+
+            updated = 0
+            for queryset, values in groups:
+                updated += super(MarkupQuerySetMixin, queryset).update(**values)
+
+            for field, rows in rerender_rows.items():
+                markup_type = kwargs[_markup_type_field_name(field.name)]
+                field._validate_markup_type(markup_type)
+                objs = [self.model(pk=pk) for pk, _ in rows]
+                rendered = field.render_markup_many(
+                    [raw for _, raw in rows], markup_type, objs
+                )
+                for obj, value in zip(objs, rendered):
+                    field._set_rendered(obj, value, markup_type)
+                self.model._base_manager.using(self.db).bulk_update(
+                    objs, field.get_rendered_columns()
+                )
+        return updated
+
+    update.alters_data = True
+
+
+class MarkupQuerySet(MarkupQuerySetMixin, models.QuerySet):
+    pass
+
+
+MarkupManager = models.Manager.from_queryset(MarkupQuerySet)
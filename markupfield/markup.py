@@ -1,103 +1,559 @@
-from functools import partial
+import hashlib
+import re
+import threading
+from functools import lru_cache
+from html.parser import HTMLParser
+from importlib import metadata
+from importlib.util import find_spec
+
+import django
 from django.utils.html import escape, linebreaks, urlize
 from django.utils.translation import pgettext_lazy as _
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+
+def _is_installed(module):
+    # only look the module up, importing it is left to the first render
+    return find_spec(module) is not None
+
+
+@lru_cache(maxsize=None)
+def package_version(name):
+    """
+    Return the installed version of the distribution ``name``, or ``""``.
+    """
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return ""
+
+
+def options_fingerprint(options):
+    """
+    Return a short hash of renderer ``options`` that is stable across
+    processes: objects other than plain values count by their class.
+    """
+
+    def describe(value):
+        if isinstance(value, (list, tuple)):
+            return [describe(item) for item in value]
+        if isinstance(value, dict):
+            return sorted((repr(key), describe(item)) for key, item in value.items())
+        if value is None or isinstance(value, (str, int, float, bool)):
+            return value
+        return "%s.%s" % (type(value).__module__, type(value).__qualname__)
+
+    return hashlib.blake2b(
+        repr(describe(options)).encode("utf-8"), digest_size=4
+    ).hexdigest()
+
+
+def render_many(renderer, markups):
+    """
+    Render each of ``markups`` with ``renderer``, lazily and in order.
+
+    Renderers can implement the batch protocol, a ``render_many(markups)``
+    method returning an iterator of rendered values, to reuse their engine
+    state across documents.  Plain callables are called once per document.
+    """
+    batch = getattr(renderer, "render_many", None)
+    if batch is None:
+        return map(renderer, markups)
+    return batch(markups)
+
+
+def split_blocks(renderer, markup):
+    """
+    Return the blocks ``renderer`` can render ``markup`` in, or ``None`` if
+    it has to be rendered as a whole.
+
+    Renderers can implement the block protocol, a ``split_blocks(markup)``
+    method and a ``join_blocks(rendered_blocks)`` method joining the rendered
+    blocks into the rendered document, to support incremental renders.
+    """
+    split = getattr(renderer, "split_blocks", None)
+    if split is None:
+        return None
+    return split(markup)
+
+
+def warmup(renderer):
+    """
+    Prepare ``renderer`` for its first render.
+
+    Renderers can implement ``warmup()`` to import and set up their engine
+    ahead of time, e.g. before a preforking server forks its workers.  Plain
+    callables are left alone.
+    """
+    method = getattr(renderer, "warmup", None)
+    if method is not None:
+        method()
+
+
+class Renderer(object):
+    """
+    Base class for renderers implementing the batch protocol on top of
+    rendering a single document.
+    """
+
+    # rendered by warmup(), covering what the first render sets up
+    warmup_markup = ""
+
+    def __call__(self, markup):
+        raise NotImplementedError
+
+    def warmup(self):
+        self(self.warmup_markup)
+
+    def render_many(self, markups):
+        for markup in markups:
+            yield self(markup)
+
+
+class HtmlRenderer(Renderer):
+    """Renderer passing HTML through unchanged."""
+
+    version = "1"
+
+    def __call__(self, markup):
+        return markup
+
+    def render_many(self, markups):
+        return iter(markups)
+
+
+class PlainRenderer(Renderer):
+    """Renderer escaping plain text and linking URLs in it."""
+
+    @property
+    def version(self):
+        # urlize and linebreaks come with Django
+        return "django-%s" % django.get_version()
+
+    def __call__(self, markup):
+        return linebreaks(urlize(escape(markup)))
+
+
+class _TextParser(HTMLParser):
+    # content of these tags isn't text
+    skipped_tags = {"script", "style", "template"}
+    # these tags separate words
+    block_tags = set(
+        "address article aside blockquote br dd div dl dt figcaption figure "
+        "footer h1 h2 h3 h4 h5 h6 header hr li main nav ol p pre section table "
+        "td th tr ul".split()
+    )
+
+    def __init__(self):
+        super(_TextParser, self).__init__(convert_charrefs=True)
+        self.parts = []
+        self.skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.skipped_tags:
+            self.skipping += 1
+        elif tag in self.block_tags:
+            self.parts.append(" ")
+
+    def handle_endtag(self, tag):
+        if tag in self.skipped_tags:
+            self.skipping = max(0, self.skipping - 1)
+        elif tag in self.block_tags:
+            self.parts.append(" ")
+
+    def handle_data(self, data):
+        if not self.skipping:
+            self.parts.append(data)
+
+
+def html_to_text(html):
+    """
+    Return the text of rendered ``html``: tags stripped, entities unescaped
+    and whitespace collapsed.
+    """
+    parser = _TextParser()
+    parser.feed(html)
+    parser.close()
+    return " ".join("".join(parser.parts).split())
+
+
+class LazyRenderer(object):
+    """
+    Renderer importing its markup engine on first use.
+
+    ``loader`` is called once, on the first render, and returns the actual
+    renderer.  Until then the engine is neither imported nor configured.
+    """
+
+    def __init__(self, name, loader):
+        self.__name__ = self.__qualname__ = name
+        self._loader = loader
+        self._renderer = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._renderer is None:
+            with self._lock:
+                if self._renderer is None:
+                    self._renderer = self._loader()
+        return self._renderer
+
+    @property
+    def version(self):
+        return getattr(self.load(), "version", "")
+
+    def __call__(self, markup):
+        return self.load()(markup)
+
+    def render_many(self, markups):
+        return render_many(self.load(), markups)
+
+    def split_blocks(self, markup):
+        return split_blocks(self.load(), markup)
+
+    def join_blocks(self, rendered_blocks):
+        return self.load().join_blocks(rendered_blocks)
+
+    def warmup(self):
+        warmup(self.load())
+
+    def __repr__(self):
+        return "<LazyRenderer: %s>" % self.__name__
+
 
 # build DEFAULT_MARKUP_TYPES
 DEFAULT_MARKUP_TYPES = [
-    ("html", lambda markup: markup, _("django-markupfield", "HTML")),
-    (
-        "plain",
-        lambda markup: linebreaks(urlize(escape(markup))),
-        _("django-markupfield", "Plain"),
-    ),
+    ("html", HtmlRenderer(), _("django-markupfield", "HTML")),
+    ("plain", PlainRenderer(), _("django-markupfield", "Plain")),
 ]
 
-try:
-    import pygments  # noqa
-
-    PYGMENTS_INSTALLED = True
-
-    def _register_pygments_rst_directive():
-        from docutils import nodes
-        from docutils.parsers.rst import directives
-        from pygments import highlight
-        from pygments.lexers import get_lexer_by_name, TextLexer
-        from pygments.formatters import HtmlFormatter
-
-        DEFAULT = HtmlFormatter()
-        VARIANTS = {
-            "linenos": HtmlFormatter(linenos=True),
-        }
-
-        def pygments_directive(
-            name,
-            arguments,
-            options,
-            content,
-            lineno,
-            content_offset,
-            block_text,
-            state,
-            state_machine,
-        ):
-            try:
-                lexer = get_lexer_by_name(arguments[0])
-            except ValueError:
-                # no lexer found - use the text one instead of an exception
-                lexer = TextLexer()
-            formatter = options and VARIANTS[options.keys()[0]] or DEFAULT
-            parsed = highlight(u"\n".join(content), lexer, formatter)
-            return [nodes.raw("", parsed, format="html")]
-
-        pygments_directive.arguments = (1, 0, 1)
-        pygments_directive.content = 1
-        directives.register_directive("code", pygments_directive)
-
-
-except ImportError:
-    PYGMENTS_INSTALLED = False
-
-try:
-    import markdown
-
-    md_filter = markdown.markdown
+PYGMENTS_INSTALLED = _is_installed("pygments")
 
-    # try and replace if pygments & codehilite are available
-    if PYGMENTS_INSTALLED:
-        try:
-            from markdown.extensions.codehilite import makeExtension  # noqa
 
-            md_filter = partial(
-                markdown.markdown, extensions=[makeExtension(css_class="highlight")]
+@lru_cache(maxsize=128)
+def _get_lexer(name):
+    from pygments.lexers import get_lexer_by_name, TextLexer
+
+    try:
+        return get_lexer_by_name(name)
+    except ValueError:
+        # no lexer found - use the text one instead of an exception
+        return TextLexer()
+
+
+@lru_cache(maxsize=16)
+def _get_formatter(**options):
+    from pygments.formatters import HtmlFormatter
+
+    return HtmlFormatter(**options)
+
+
+@lru_cache(maxsize=None)
+def register_pygments_rst_directive():
+    """
+    Register the ReST ``code`` directive highlighting with pygments, for every
+    docutils parser.  ``RestRenderer`` does this on its first render, call it
+    from renderers built on ``publish_parts`` and the like.  Needs pygments.
+    """
+    from docutils import nodes
+    from docutils.parsers.rst import directives
+    from pygments import highlight
+
+    def pygments_directive(
+        name,
+        arguments,
+        options,
+        content,
+        lineno,
+        content_offset,
+        block_text,
+        state,
+        state_machine,
+    ):
+        # lexers and formatters are looked up once and then reused
+        lexer = _get_lexer(arguments[0])
+        formatter = _get_formatter(linenos="linenos" in options)
+        parsed = highlight(u"\n".join(content), lexer, formatter)
+        return [nodes.raw("", parsed, format="html")]
+
+    pygments_directive.arguments = (1, 0, 1)
+    pygments_directive.options = {"linenos": directives.flag}
+    pygments_directive.content = 1
+    directives.register_directive("code", pygments_directive)
+
+
+class MarkdownRenderer(Renderer):
+    """
+    Markdown renderer reusing a ``markdown.Markdown`` instance per thread.
+
+    ``markdown.markdown`` builds a new instance, with all of its extensions,
+    for every document.  Here the instance is built once per thread from
+    ``kwargs`` and ``reset()`` before each document, giving the same output.
+    Pass extensions by name so that every instance gets its own.
+    """
+
+    # extensions rendering each block on its own
+    block_local_extensions = frozenset(
+        [
+            "attr_list",
+            "codehilite",
+            "fenced_code",
+            "nl2br",
+            "sane_lists",
+            "smarty",
+            "tables",
+        ]
+    )
+
+    warmup_markup = (
+        "# Title\n\n*emphasis*, **strong** and a [link](http://example.com)\n\n"
+        "* item\n\n> quote\n\n    :::python\n    x = 1\n"
+    )
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self._local = threading.local()
+        self._version = None
+
+    @property
+    def version(self):
+        # the library and the options, upgrading or changing either can
+        # change the output
+        if self._version is None:
+            version = "markdown-%s-%s" % (
+                package_version("Markdown"),
+                options_fingerprint(self.kwargs),
             )
-        except ImportError:
-            pass
+            if "codehilite" in repr(self.kwargs.get("extensions")):
+                version += "-pygments-%s" % package_version("Pygments")
+            self._version = version
+        return self._version
+
+    def get_markdown(self):
+        md = getattr(self._local, "md", None)
+        if md is None:
+            import markdown
+
+            md = self._local.md = markdown.Markdown(**self.kwargs)
+        return md
+
+    def __call__(self, markup):
+        return self.get_markdown().reset().convert(markup)
+
+    def render_many(self, markups):
+        md = self.get_markdown()
+        for markup in markups:
+            yield md.reset().convert(markup)
+
+    def split_blocks(self, markup):
+        """
+        Split ``markup`` before every ATX heading or paragraph starting at
+        the beginning of a line after a blank line, outside fenced code.
+
+        Returns ``None`` when blocks depend on each other: with reference
+        definitions, footnotes, abbreviations, raw HTML or extensions not
+        known to keep to one block.
+        """
+        for extension in self.kwargs.get("extensions", ()):
+            if not isinstance(extension, str):
+                return None
+            if extension.rsplit(".", 1)[-1] not in self.block_local_extensions:
+                return None
+        if _MARKDOWN_CROSS_BLOCK_RE.search(markup):
+            return None
+        blocks = []
+        lines = []
+        fence = None
+        blank = False
+        for line in markup.split("\n"):
+            if fence is not None:
+                if line.rstrip(" ") == fence:
+                    fence = None
+            elif line.startswith(("```", "~~~")):
+                fence = _MARKDOWN_FENCE_RE.match(line).group()
+            elif blank and lines and _MARKDOWN_BLOCK_START_RE.match(line):
+                blocks.append(lines)
+                lines = []
+            blank = not line.strip()
+            lines.append(line)
+        if fence is not None:
+            return None
+        blocks.append(lines)
+        # the output of a document is stripped, a paragraph after each block
+        # keeps the whitespace separating it from the next one
+        return [
+            "%s\n\n%s" % ("\n".join(_strip_blank_lines(lines)), _MARKDOWN_BLOCK_END)
+            for lines in blocks
+            if "".join(lines).strip()
+        ]
+
+    def join_blocks(self, rendered_blocks):
+        end = "<p>%s</p>" % _MARKDOWN_BLOCK_END
+        return "".join(
+            block[: -len(end)] if block.endswith(end) else block
+            for block in rendered_blocks
+        ).strip()
+
+
+# reference definitions (including footnotes), abbreviations, raw HTML and
+# the table of contents marker affect other blocks
+_MARKDOWN_CROSS_BLOCK_RE = re.compile(
+    r"^(?: {0,3}\[[^\]]+\]:|\*\[|<|\[TOC\])", re.MULTILINE
+)
+_MARKDOWN_FENCE_RE = re.compile(r"`{3,}|~{3,}")
+# lines that start a block no matter what precedes them after a blank line
+_MARKDOWN_BLOCK_START_RE = re.compile(r"#|[^\W\d_]")
+_MARKDOWN_BLOCK_END = "markupfieldblockend"
+
+
+def _strip_blank_lines(lines):
+    # blank lines at the end of a block don't change its output
+    while not lines[-1].strip():
+        lines.pop()
+    return lines
 
-    # whichever markdown_filter was available
+
+def _load_markdown():
+    # try and replace if pygments & codehilite are available
+    if PYGMENTS_INSTALLED and _is_installed("markdown.extensions.codehilite"):
+        codehilite = "markdown.extensions.codehilite"
+        return MarkdownRenderer(
+            extensions=[codehilite],
+            extension_configs={codehilite: {"css_class": "highlight"}},
+        )
+    return MarkdownRenderer()
+
+
+if _is_installed("markdown"):
     DEFAULT_MARKUP_TYPES.append(
-        ("markdown", md_filter, _("django-markupfield", "Markdown"))
+        (
+            "markdown",
+            LazyRenderer("render_markdown", _load_markdown),
+            _("django-markupfield", "Markdown"),
+        )
+    )
+
+
+class RestRenderer(Renderer):
+    """
+    ReST renderer building the docutils settings and components once.
+
+    ``docutils.core.publish_parts`` builds the option parser, settings,
+    reader, parser and writer for every document.  Here the settings are
+    built once, from ``RESTRUCTUREDTEXT_FILTER_SETTINGS`` unless
+    ``settings_overrides`` is given, and each thread reuses its own
+    publisher.  Raw directives and file insertion are always disabled.
+    """
+
+    warmup_markup = (
+        "Title\n=====\n\n*emphasis*, **strong** and a `link <http://example.com>`_\n\n"
+        "* item\n\n.. note:: note\n\n.. code:: python\n\n   x = 1\n"
     )
 
-except ImportError:
-    pass
+    def __init__(self, writer_name="html4css1", settings_overrides=None):
+        self.writer_name = writer_name
+        self.settings_overrides = settings_overrides
+        self._lock = threading.Lock()
+        self.reset()
 
-try:
-    from docutils.core import publish_parts
+    def reset(self):
+        """
+        Drop the settings and publishers, they are rebuilt on the next render.
+        """
+        self._settings = None
+        self._version = None
+        self._local = threading.local()
 
-    if PYGMENTS_INSTALLED:
-        _register_pygments_rst_directive()
+    @property
+    def version(self):
+        # the library, the settings and pygments for the code directive
+        if self._version is None:
+            version = "docutils-%s-%s" % (
+                package_version("docutils"),
+                options_fingerprint([self.writer_name, self.get_overrides()]),
+            )
+            if PYGMENTS_INSTALLED:
+                version += "-pygments-%s" % package_version("Pygments")
+            self._version = version
+        return self._version
 
-    def render_rest(markup):
-        overrides = getattr(settings, "RESTRUCTUREDTEXT_FILTER_SETTINGS", {})
+    def get_overrides(self):
+        if self.settings_overrides is None:
+            overrides = getattr(settings, "RESTRUCTUREDTEXT_FILTER_SETTINGS", {})
+        else:
+            overrides = self.settings_overrides
+        # copied, the setting itself is never modified
+        overrides = dict(overrides)
         overrides.update({"raw_enabled": False, "file_insertion_enabled": False})
-        parts = publish_parts(
-            source=markup, writer_name="html4css1", settings_overrides=overrides
-        )
-        return parts["fragment"]
+        return overrides
+
+    def get_publisher(self):
+        publisher = getattr(self._local, "publisher", None)
+        if publisher is None:
+            from docutils import io, parsers, readers, writers
+            from docutils.core import Publisher
 
+            # registered once, by whichever renderer comes first
+            if PYGMENTS_INSTALLED:
+                register_pygments_rst_directive()
+
+            parser = parsers.get_parser_class("restructuredtext")()
+            publisher = Publisher(
+                readers.get_reader_class("standalone")(parser),
+                parser,
+                writers.get_writer_class(self.writer_name)(),
+                source_class=io.StringInput,
+                destination_class=io.StringOutput,
+            )
+            if self._settings is None:
+                with self._lock:
+                    if self._settings is None:
+                        publisher.process_programmatic_settings(
+                            None, self.get_overrides(), None
+                        )
+                        self._settings = publisher.settings
+            # publishing writes to the settings, each thread gets a copy
+            publisher.settings = self._settings.copy()
+            self._local.publisher = publisher
+        return publisher
+
+    def render_parts(self, markup, publisher=None):
+        if publisher is None:
+            publisher = self.get_publisher()
+        publisher.set_source(markup)
+        publisher.set_destination()
+        publisher.publish()
+        return publisher.writer.parts
+
+    def __call__(self, markup):
+        return self.render_parts(markup)["fragment"]
+
+    def render_many(self, markups):
+        publisher = self.get_publisher()
+        for markup in markups:
+            yield self.render_parts(markup, publisher)["fragment"]
+
+
+render_rest = RestRenderer()
+
+
+@receiver(setting_changed)
+def _reset_render_rest(setting, **kwargs):
+    if setting == "RESTRUCTUREDTEXT_FILTER_SETTINGS":
+        render_rest.reset()
+
+
+def _load_rest():
+    return render_rest
+
+
+if _is_installed("docutils"):
     DEFAULT_MARKUP_TYPES.append(
-        ("restructuredtext", render_rest, _("django-markupfield", "Restructured Text"))
+        (
+            "restructuredtext",
+            LazyRenderer("render_rest", _load_rest),
+            _("django-markupfield", "Restructured Text"),
+        )
     )
-except ImportError:
-    pass
@@ -0,0 +1,118 @@
+"""
+The markup types offered by MarkupFields that don't set ``markup_choices``.
+
+Those fields share the renderers registered here, other code can add or
+replace types before the models are imported::
+
+    from markupfield.registry import renderers
+
+    renderers.register("textile", render_textile, "Textile")
+"""
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from markupfield import markup
+
+
+class RendererRegistry(object):
+    """
+    Markup types by name, each with a renderer and a title, in the order
+    they were registered.  Until the first change it holds the types of the
+    ``MARKUP_FIELD_TYPES`` setting, or the detected default types.
+    """
+
+    def __init__(self):
+        self._types = None
+        self._lock = threading.Lock()
+
+    def get_types(self):
+        if self._types is None:
+            with self._lock:
+                if self._types is None:
+                    types = getattr(
+                        settings, "MARKUP_FIELD_TYPES", markup.DEFAULT_MARKUP_TYPES
+                    )
+                    self._types = dict(
+                        (mc[0], (mc[1], mc[2] if len(mc) == 3 else mc[0]))
+                        for mc in types
+                    )
+        return self._types
+
+    def register(self, name, renderer, title=None):
+        """
+        Register ``renderer`` for the markup type ``name``, replacing the
+        renderer already registered for it.
+        """
+        self.get_types()[name] = (renderer, name if title is None else title)
+
+    def unregister(self, name):
+        """
+        Remove the markup type ``name``, raises ``KeyError`` if it isn't
+        registered.
+        """
+        del self.get_types()[name]
+
+    def reset(self):
+        """
+        Drop registered changes and read the types from the settings again.
+        """
+        self._types = None
+
+    def __contains__(self, name):
+        return name in self.get_types()
+
+    def get(self, name):
+        """
+        Return the renderer of the markup type ``name``.
+        """
+        return self.get_types()[name][0]
+
+    def choices(self, names=None):
+        """
+        Return ``(name, renderer, title)`` of the registered types, or of
+        ``names`` in their order.
+        """
+        types = self.get_types()
+        if names is None:
+            names = list(types)
+        return [(name,) + types[name] for name in names]
+
+
+renderers = RendererRegistry()
+
+
+@receiver(setting_changed)
+def _reset_renderers(setting, **kwargs):
+    if setting == "MARKUP_FIELD_TYPES":
+        renderers.reset()
+
+
+def warmup():
+    """
+    Warm up the registered renderers and those of every MarkupField, each
+    renderer once.  Returns ``(markup type, renderer, seconds)`` per renderer.
+    """
+    from markupfield.fields import get_markup_fields
+
+    choices = renderers.choices()
+    for model in apps.get_models():
+        for field in get_markup_fields(model):
+            choices.extend(
+                (name, field.markup_choices_dict[name], None)
+                for name in field.markup_choices_list
+            )
+    results = []
+    seen = set()
+    for name, renderer, _ in choices:
+        if id(renderer) in seen:
+            continue
+        seen.add(id(renderer))
+        started = time.perf_counter()
+        markup.warmup(renderer)
+        results.append((name, renderer, time.perf_counter() - started))
+    return results
@@ -0,0 +1,142 @@
+"""
+JSON Lines serializer storing every MarkupField as one payload holding its
+raw value, markup type and rendered value.  Loading it stores the rendered
+value, checked against the hash in the payload, instead of rendering::
+
+    SERIALIZATION_MODULES = {'markupjsonl': 'markupfield.serializers'}
+
+    ./manage.py dumpdata blog --format markupjsonl -o blog.markupjsonl
+    ./manage.py loaddata blog.markupjsonl
+
+Objects are written and read one line at a time.
+"""
+import json
+
+from django.apps import apps
+from django.conf import settings
+from django.core.serializers import jsonl
+from django.core.serializers.base import DeserializationError
+from django.core.serializers.python import Deserializer as PythonDeserializer
+
+from markupfield.fields import (
+    get_markup_fields,
+    rendered_hash,
+    _markup_type_field_name,
+    _rendered_field_name,
+    _version_field_name,
+)
+
+
+def _companion_columns(model):
+    # columns of MarkupFields held by their payloads
+    columns = set()
+    for field in get_markup_fields(model):
+        columns.add(_markup_type_field_name(field.name))
+        columns.update(field.get_rendered_columns())
+    return columns
+
+
+class Serializer(jsonl.Serializer):
+    def start_serialization(self):
+        super(Serializer, self).start_serialization()
+        self._markup_fields = {}
+
+    def handle_field(self, obj, field):
+        model = obj._meta.concrete_model
+        if model not in self._markup_fields:
+            self._markup_fields[model] = (
+                set(field.name for field in get_markup_fields(model)),
+                _companion_columns(model),
+            )
+        markup_fields, companions = self._markup_fields[model]
+        if field.name in markup_fields:
+            self._current[field.name] = self.get_markup_payload(obj, field)
+        elif field.name not in companions:
+            super(Serializer, self).handle_field(obj, field)
+
+    def get_markup_payload(self, obj, field):
+        # the stored value, a pending deferred render isn't run
+        rendered = getattr(obj, _rendered_field_name(field.attname))
+        payload = {
+            "raw": getattr(obj, field.attname).raw,
+            "markup_type": getattr(obj, _markup_type_field_name(field.attname)),
+            "rendered": rendered,
+            "hash": rendered_hash(rendered),
+        }
+        if field.store_version:
+            payload["version"] = getattr(obj, _version_field_name(field.attname))
+        return payload
+
+
+def _get_lines(stream):
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except Exception as e:
+            raise DeserializationError() from e
+
+
+def _expand_payload(field, payload, verify_hash, pk):
+    raw = payload.get("raw")
+    markup_type = payload.get("markup_type")
+    rendered = payload.get("rendered")
+    version = payload.get("version")
+    if raw is not None:
+        try:
+            field._validate_markup_type(markup_type)
+        except ValueError as e:
+            raise DeserializationError("%s (pk=%s): %s" % (field, pk, e))
+    if rendered is None and raw is not None:
+        # dumped before a deferred render happened
+        rendered = field.render_markup(raw, markup_type)
+        version = field.get_render_version(markup_type)
+    elif verify_hash and payload.get("hash") != rendered_hash(rendered):
+        raise DeserializationError(
+            "%s (pk=%s): the rendered value doesn't match its hash" % (field, pk)
+        )
+    values = field.get_rendered_values(rendered, markup_type)
+    if field.store_version:
+        # the version that rendered the payload, not the current one
+        values[_version_field_name(field.attname)] = version
+    values[field.name] = raw
+    values[_markup_type_field_name(field.name)] = markup_type
+    return values
+
+
+def _expand(objects, verify_hash):
+    for obj in objects:
+        try:
+            model = apps.get_model(obj["model"])
+        except (LookupError, KeyError, TypeError, ValueError):
+            # reported by the python deserializer
+            yield obj
+            continue
+        fields = obj.get("fields", {})
+        for field in get_markup_fields(model):
+            payload = fields.get(field.name)
+            if isinstance(payload, dict):
+                fields.update(
+                    _expand_payload(field, payload, verify_hash, obj.get("pk"))
+                )
+        yield obj
+
+
+def Deserializer(stream_or_string, verify_hash=None, **options):
+    """
+    Deserialize JSON Lines written by ``Serializer``, lazily.
+
+    The rendered value of each payload is checked against its hash unless
+    ``verify_hash`` (default: the ``MARKUP_FIELD_VERIFY_SERIALIZED_HASH``
+    setting, ``True`` unless set) is false.
+    """
+    if verify_hash is None:
+        verify_hash = getattr(settings, "MARKUP_FIELD_VERIFY_SERIALIZED_HASH", True)
+    if isinstance(stream_or_string, bytes):
+        stream_or_string = stream_or_string.decode()
+    if isinstance(stream_or_string, str):
+        stream_or_string = stream_or_string.splitlines()
+    yield from PythonDeserializer(
+        _expand(_get_lines(stream_or_string), verify_hash), **options
+    )
@@ -0,0 +1,6 @@
+from django.dispatch import Signal
+
+# sent after every render with sender=the model class and the arguments
+# field, instance (None if the render isn't for a single instance),
+# markup_type, duration (seconds), raw_size and rendered_size (bytes)
+markup_rendered = Signal()
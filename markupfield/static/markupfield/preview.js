@@ -0,0 +1,98 @@
+/*
+ * Live preview of MarkupTextarea widgets with a preview field: the text is
+ * sent to markupfield.views.preview once typing pauses and the rendered
+ * value is shown below the textarea.
+ */
+(function () {
+    "use strict";
+
+    // milliseconds without changes before a preview is requested
+    var DELAY = 500;
+
+    function csrfToken(textarea) {
+        var input = textarea.form && textarea.form.querySelector(
+            "input[name=csrfmiddlewaretoken]"
+        );
+        if (input) {
+            return input.value;
+        }
+        var match = document.cookie.match(/(?:^|;\s*)csrftoken=([^;]+)/);
+        return match ? decodeURIComponent(match[1]) : "";
+    }
+
+    function markupType(textarea) {
+        var name = textarea.getAttribute("data-markupfield-markup-type");
+        var select = textarea.form && textarea.form.elements.namedItem(name);
+        return select ? select.value : "";
+    }
+
+    function setUp(textarea) {
+        var preview = document.createElement("div");
+        preview.className = "markupfield-preview";
+        textarea.parentNode.insertBefore(preview, textarea.nextSibling);
+
+        var timer = null;
+        var controller = null;
+        var shown = null;
+
+        function update() {
+            var data = new FormData();
+            data.append("field", textarea.getAttribute("data-markupfield-field"));
+            data.append("markup_type", markupType(textarea));
+            data.append("text", textarea.value);
+            var request = data.get("markup_type") + "\0" + textarea.value;
+            if (request === shown) {
+                return;
+            }
+            // only the latest preview is shown
+            if (controller) {
+                controller.abort();
+            }
+            controller = new AbortController();
+            fetch(textarea.getAttribute("data-markupfield-preview"), {
+                method: "POST",
+                body: data,
+                credentials: "same-origin",
+                headers: {"X-CSRFToken": csrfToken(textarea)},
+                signal: controller.signal
+            }).then(function (response) {
+                return response.json();
+            }).then(function (result) {
+                if (result.error) {
+                    preview.textContent = result.error;
+                } else {
+                    preview.innerHTML = result.rendered;
+                    shown = request;
+                }
+            }).catch(function (error) {
+                if (error.name !== "AbortError") {
+                    preview.textContent = String(error);
+                }
+            });
+        }
+
+        function schedule() {
+            clearTimeout(timer);
+            timer = setTimeout(update, DELAY);
+        }
+
+        textarea.addEventListener("input", schedule);
+        var name = textarea.getAttribute("data-markupfield-markup-type");
+        var select = textarea.form && textarea.form.elements.namedItem(name);
+        if (select && select.addEventListener) {
+            select.addEventListener("change", schedule);
+        }
+        update();
+    }
+
+    function setUpAll() {
+        var textareas = document.querySelectorAll("textarea[data-markupfield-preview]");
+        Array.prototype.forEach.call(textareas, setUp);
+    }
+
+    if (document.readyState === "loading") {
+        document.addEventListener("DOMContentLoaded", setUpAll);
+    } else {
+        setUpAll();
+    }
+})();
@@ -0,0 +1,54 @@
+import math
+import threading
+from bisect import bisect_left
+
+# upper bounds in seconds of the render duration histogram
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class RenderStats(object):
+    """
+    Count, duration histogram and input and output sizes of the renders done
+    in this process, per markup type.
+    """
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, markup_type, duration, raw_size, rendered_size):
+        with self._lock:
+            stats = self._stats.get(markup_type)
+            if stats is None:
+                stats = self._stats[markup_type] = {
+                    "count": 0,
+                    "duration": 0.0,
+                    "histogram": [0] * (len(self.buckets) + 1),
+                    "raw_bytes": 0,
+                    "rendered_bytes": 0,
+                }
+            stats["count"] += 1
+            stats["duration"] += duration
+            stats["histogram"][bisect_left(self.buckets, duration)] += 1
+            stats["raw_bytes"] += raw_size
+            stats["rendered_bytes"] += rendered_size
+
+    def snapshot(self):
+        """
+        Return the stats by markup type, histograms as a list of
+        ``(upper bound, count)`` pairs.
+        """
+        bounds = self.buckets + (math.inf,)
+        with self._lock:
+            return {
+                markup_type: dict(stats, histogram=list(zip(bounds, stats["histogram"])))
+                for markup_type, stats in self._stats.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+render_stats = RenderStats()
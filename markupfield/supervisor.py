@@ -0,0 +1,112 @@
+import multiprocessing
+import threading
+
+from django.apps import apps
+
+
+class RenderAborted(Exception):
+    """
+    A render in a worker process timed out or its process died.
+    """
+
+
+def setup_worker():
+    """
+    Set up Django in a worker process, those started with the spawn method
+    don't inherit it.  Used as the initializer of process pools.
+    """
+    if not apps.ready:
+        import django
+
+        django.setup()
+
+
+def _render_in_worker(field, markup_type, source):
+    return field.markup_choices_dict[markup_type](source)
+
+
+def _worker_loop(conn):
+    setup_worker()
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        try:
+            result = (True, _render_in_worker(*task))
+        except Exception as e:
+            result = (False, e)
+        try:
+            conn.send(result)
+        except Exception:
+            # the exception couldn't be pickled
+            conn.send((False, RuntimeError(repr(result[1]))))
+
+
+class RenderWorker(object):
+    """
+    A process rendering one document at a time.  A render running longer
+    than its timeout kills the process, the next render starts a new one.
+    """
+
+    def __init__(self):
+        self.process = None
+        self.conn = None
+
+    def start(self):
+        context = multiprocessing.get_context()
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_loop,
+            args=(child_conn,),
+            name="markupfield-render",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+
+    def stop(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.join()
+            self.conn.close()
+            self.process = self.conn = None
+
+    def render(self, field, markup_type, source, timeout):
+        """
+        Render ``source`` with ``field``'s renderer for ``markup_type`` and
+        return the result, raises ``RenderAborted`` if that took more than
+        ``timeout`` seconds or the process died.
+        """
+        if self.process is None or not self.process.is_alive():
+            self.stop()
+            self.start()
+        try:
+            # a process dying between the check above and the send breaks
+            # the pipe
+            self.conn.send((field, markup_type, source))
+            if not self.conn.poll(timeout):
+                raise RenderAborted("timed out after %ss" % timeout)
+            ok, result = self.conn.recv()
+        except (EOFError, OSError):
+            self.stop()
+            raise RenderAborted("the render process died")
+        except RenderAborted:
+            self.stop()
+            raise
+        if not ok:
+            raise result
+        return result
+
+
+_local = threading.local()
+
+
+def get_render_worker():
+    """
+    Return the render worker of the current thread.
+    """
+    worker = getattr(_local, "worker", None)
+    if worker is None:
+        worker = _local.worker = RenderWorker()
+    return worker
@@ -0,0 +1,22 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from markupfield.cache import get_fragment
+from markupfield.fields import Markup
+
+register = template.Library()
+
+
+@register.filter
+def cached_markup(value):
+    """
+    Output a MarkupField like ``{{ value }}`` does, through the fragment
+    cache::
+
+        {% load markupfield_tags %}
+        {{ article.body|cached_markup }}
+    """
+    if not isinstance(value, Markup):
+        return value
+    rendered = get_fragment(value)
+    return mark_safe("" if rendered is None else rendered)
@@ -1,6 +1,14 @@
+import os
+import time
+from functools import partial
+
+import markdown
+
 from django.db import models
 
-from markupfield.fields import MarkupField
+from markupfield.fields import MarkupField, ParallelRenderMixin, render_deferred
+from markupfield.managers import MarkupManager
+from markupfield.markup import MarkdownRenderer, PlainRenderer, Renderer
 
 
 class Post(models.Model):
@@ -50,3 +58,260 @@ class NullDefaultTestModel(models.Model):
     text = MarkupField(
         null=False, blank=True, default="*nice*", default_markup_type="markdown"
     )
+
+
+# renders are recorded so tests can check when the renderer is called
+RENDER_CALLS = []
+
+
+def counting_render(markup):
+    RENDER_CALLS.append(markup)
+    return markup.upper()
+
+
+def slow_render(markup):
+    time.sleep(0.2)
+    return counting_render(markup)
+
+
+# every batch handed to TitleRenderer.render_many
+BATCH_CALLS = []
+
+
+class TitleRenderer(Renderer):
+    def __call__(self, markup):
+        return markup.title()
+
+    def render_many(self, markups):
+        markups = list(markups)
+        BATCH_CALLS.append(markups)
+        return super(TitleRenderer, self).render_many(markups)
+
+
+class CountedPost(models.Model):
+    title = models.CharField(max_length=50)
+    body = MarkupField(
+        default_markup_type="upper",
+        markup_choices=(
+            ("upper", counting_render),
+            ("lower", lambda markup: markup.lower()),
+            ("slow", slow_render),
+            ("title", TitleRenderer()),
+        ),
+    )
+
+    objects = MarkupManager()
+
+
+class ProxyCountedPost(CountedPost):
+    class Meta:
+        proxy = True
+
+
+class ChildCountedPost(CountedPost):
+    subtitle = models.CharField(max_length=50, blank=True)
+
+
+class PublishedManager(models.Manager):
+    def get_queryset(self):
+        return super(PublishedManager, self).get_queryset().filter(published=True)
+
+
+class PublishedPost(models.Model):
+    published = models.BooleanField(default=False)
+    body = MarkupField(markup_type="upper", markup_choices=(("upper", counting_render),))
+
+    objects = PublishedManager()
+
+
+# run deferred renders right away, once the transaction commits
+DEFERRED_RENDERS = []
+
+
+def inline_executor(model_label, pk, field_name, using):
+    DEFERRED_RENDERS.append((model_label, pk, field_name))
+    render_deferred(model_label, pk, field_name, using)
+
+
+class DeferredPost(models.Model):
+    body = MarkupField(
+        markup_type="upper",
+        markup_choices=(("upper", counting_render),),
+        render_mode="deferred",
+        deferred_executor=inline_executor,
+    )
+
+    objects = MarkupManager()
+
+
+class SearchPost(models.Model):
+    body = MarkupField(
+        default_markup_type="markdown", store_text=True, excerpt_length=20
+    )
+
+    objects = MarkupManager()
+
+
+class CompressedPost(models.Model):
+    body = MarkupField(default_markup_type="markdown", compress_rendered="zlib")
+
+    objects = MarkupManager()
+
+
+class DefaultCompressedPost(models.Model):
+    body = MarkupField(default_markup_type="markdown", compress_rendered=True)
+
+
+def hanging_render(markup):
+    time.sleep(30)
+    return markup
+
+
+def crashing_render(markup):
+    # like a render killed for running out of memory
+    os._exit(1)
+
+
+SUPERVISED_CHOICES = (
+    ("upper", counting_render),
+    ("hang", hanging_render),
+    ("crash", crashing_render),
+    ("markdown", MarkdownRenderer()),
+)
+
+
+class SupervisedPost(models.Model):
+    body = MarkupField(
+        default_markup_type="upper",
+        markup_choices=SUPERVISED_CHOICES,
+        max_raw_length={"upper": 100},
+        render_timeout=0.5,
+    )
+    strict = MarkupField(
+        default_markup_type="upper",
+        markup_choices=SUPERVISED_CHOICES,
+        max_raw_length={"upper": 100},
+        render_timeout={"upper": 5, "hang": 0.5, "crash": 0.5},
+        render_fallback="raise",
+        blank=True,
+    )
+
+
+# every document, or block of one, rendered by BlockCountingRenderer
+BLOCK_RENDERS = []
+
+
+class BlockCountingRenderer(MarkdownRenderer):
+    def __call__(self, markup):
+        BLOCK_RENDERS.append(markup)
+        return super(BlockCountingRenderer, self).__call__(markup)
+
+    def render_many(self, markups):
+        markups = list(markups)
+        BLOCK_RENDERS.extend(markups)
+        return super(BlockCountingRenderer, self).render_many(markups)
+
+
+class IncrementalPost(models.Model):
+    body = MarkupField(
+        default_markup_type="markdown",
+        markup_choices=(
+            ("markdown", BlockCountingRenderer(extensions=["fenced_code"])),
+            ("upper", counting_render),
+        ),
+        incremental=True,
+    )
+    comment = MarkupField(
+        default_markup_type="markdown",
+        markup_choices=(("markdown", MarkdownRenderer()),),
+        escape_html=True,
+        incremental=True,
+        blank=True,
+    )
+
+    objects = MarkupManager()
+
+
+class VersionedRenderer(Renderer):
+    version = "1"
+
+    def __call__(self, markup):
+        return counting_render(markup)
+
+
+VERSIONED_RENDERER = VersionedRenderer()
+
+
+class VersionedPost(models.Model):
+    body = MarkupField(
+        default_markup_type="upper",
+        markup_choices=(
+            ("upper", VERSIONED_RENDERER),
+            ("lower", lambda markup: markup.lower()),
+        ),
+        store_version=True,
+        refresh_stale=True,
+        deferred_executor=inline_executor,
+    )
+
+    objects = MarkupManager()
+
+
+class HashedPost(models.Model):
+    body = MarkupField(default_markup_type="markdown", store_hash=True)
+
+    objects = MarkupManager()
+
+
+def failing_render(markup):
+    raise ValueError("cannot render %s" % markup)
+
+
+PARALLEL_CHOICES = (
+    ("slow", slow_render),
+    ("upper", counting_render),
+    ("fail", failing_render),
+)
+
+
+class ParallelPost(ParallelRenderMixin, models.Model):
+    title = MarkupField(default_markup_type="slow", markup_choices=PARALLEL_CHOICES)
+    body = MarkupField(default_markup_type="slow", markup_choices=PARALLEL_CHOICES)
+    summary = MarkupField(default_markup_type="slow", markup_choices=PARALLEL_CHOICES)
+
+
+PREVIEW_CHOICES = (("upper", counting_render), ("plain", PlainRenderer()))
+
+
+class PreviewPost(models.Model):
+    body = MarkupField(
+        default_markup_type="upper", markup_choices=PREVIEW_CHOICES, preview=True
+    )
+    fixed = MarkupField(markup_type="plain", markup_choices=PREVIEW_CHOICES, preview=True)
+    no_preview = MarkupField(default_markup_type="upper", markup_choices=PREVIEW_CHOICES)
+
+
+class FlagRenderer(object):
+    # configured renderers sharing a name
+    def __init__(self, upper):
+        self.upper = upper
+
+    def __call__(self, markup):
+        return markup.upper() if self.upper else markup
+
+
+class ConfiguredRendererPost(models.Model):
+    plain = MarkupField(
+        default_markup_type="markdown",
+        markup_choices=(
+            ("markdown", partial(markdown.markdown)),
+            ("flag", FlagRenderer(False)),
+        ),
+    )
+    toc = MarkupField(
+        default_markup_type="markdown",
+        markup_choices=(
+            ("markdown", partial(markdown.markdown, extensions=["markdown.extensions.toc"])),
+            ("flag", FlagRenderer(True)),
+        ),
+    )
@@ -2,6 +2,7 @@ import os
 import markdown
 from django.utils.html import escape, linebreaks, urlize
 from docutils.core import publish_parts
+from markupfield.markup import register_pygments_rst_directive
 
 DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
 
@@ -22,6 +23,9 @@ else:
     }
 
 
+register_pygments_rst_directive()
+
+
 def render_rest(markup):
     parts = publish_parts(source=markup, writer_name="html4css1")
     return parts["fragment"]
@@ -33,10 +37,12 @@ MARKUP_FIELD_TYPES = [
     ("plain", lambda markup: urlize(linebreaks(escape(markup)))),
 ]
 
-INSTALLED_APPS = ("markupfield.tests",)
+INSTALLED_APPS = ("markupfield", "markupfield.tests")
 
 SECRET_KEY = "sekrit"
 
 MIDDLEWARE_CLASSES = ()
 
 ROOT_URLCONF = ()
+
+SERIALIZATION_MODULES = {"markupjsonl": "markupfield.serializers"}
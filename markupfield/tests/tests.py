@@ -1,10 +1,68 @@
+import asyncio
 import json
+import copy
+import multiprocessing.connection
+import time
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+import types
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from unittest import mock
+
 import django
-from django.test import TestCase
+from django.http import HttpResponse
+from django.template import Context, Engine
+from django.test import (
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.views.decorators.http import condition
 from django.core import serializers
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
+from django.core.serializers.base import DeserializationError
+from django.core.management.base import CommandError
+from django.apps import apps
+from django.db import DatabaseError, connection
 from django.utils.encoding import force_str
-from markupfield.markup import DEFAULT_MARKUP_TYPES
-from markupfield.fields import MarkupField, Markup, MarkupDescriptor
+from markupfield.markup import (
+    DEFAULT_MARKUP_TYPES,
+    LazyRenderer,
+    MarkdownRenderer,
+    Renderer,
+    RestRenderer,
+    html_to_text,
+    render_many,
+)
+from markupfield import compression
+from markupfield.signals import markup_rendered
+from markupfield.stats import render_stats
+from markupfield.supervisor import RenderAborted, RenderWorker
+from markupfield.cache import (
+    LRURenderCache,
+    get_block_cache,
+    get_preview_cache,
+    get_render_cache,
+    is_identifiable,
+    renderer_identity,
+)
+from markupfield.fields import (
+    MarkupField,
+    Markup,
+    MarkupDescriptor,
+    MarkupRenderError,
+    arender_instances,
+    render_fields,
+    rendered_hash,
+)
+from markupfield.registry import renderers, warmup
+from markupfield.views import markup_etag, preview
 from markupfield.widgets import MarkupTextarea, AdminMarkupTextareaWidget
 from markupfield.tests.models import (
     Post,
@@ -13,6 +71,27 @@ from markupfield.tests.models import (
     NullTestModel,
     DefaultTestModel,
     NullDefaultTestModel,
+    CountedPost,
+    ProxyCountedPost,
+    ChildCountedPost,
+    PublishedPost,
+    DeferredPost,
+    SearchPost,
+    CompressedPost,
+    DefaultCompressedPost,
+    SupervisedPost,
+    IncrementalPost,
+    VersionedPost,
+    VERSIONED_RENDERER,
+    HashedPost,
+    ParallelPost,
+    ConfiguredRendererPost,
+    PreviewPost,
+    RENDER_CALLS,
+    BLOCK_RENDERS,
+    DEFERRED_RENDERS,
+    BATCH_CALLS,
+    counting_render,
 )
 
 from django.forms.models import modelform_factory
@@ -250,6 +329,41 @@ class MarkupFieldTestCase(TestCase):
             rendered = markup_type[1]("test")
             self.assertTrue(hasattr(rendered, "__str__"))
 
+    def test_lazy_engine_imports(self):
+        # importing the module must not import any markup engine
+        code = (
+            "import sys, markupfield.markup; "
+            "print([m for m in ('markdown', 'docutils', 'pygments') "
+            "if m in sys.modules])"
+        )
+        output = subprocess.check_output([sys.executable, "-c", code])
+        self.assertEqual(output.strip(), b"[]")
+
+    def test_rest_code_directive_without_lazy_renderer(self):
+        # the pygments directive doesn't depend on the default renderer
+        code = (
+            "from django.conf import settings; settings.configure(); "
+            "from markupfield.markup import RestRenderer, render_rest; "
+            "print(render_rest('.. code:: python\\n\\n   x = 1\\n')); "
+            "print(RestRenderer()('.. code:: python\\n\\n   x = 1\\n'))"
+        )
+        output = subprocess.check_output([sys.executable, "-c", code])
+        self.assertEqual(output.count(b'<div class="highlight">'), 2)
+
+    def test_register_pygments_rst_directive(self):
+        # publish_parts only highlights once the directive is registered
+        code = (
+            "from docutils.core import publish_parts; "
+            "from markupfield.markup import register_pygments_rst_directive; "
+            "source = '.. code:: python\\n\\n   x = 1\\n'; "
+            "print(publish_parts(source, writer_name='html4css1')['fragment']); "
+            "register_pygments_rst_directive(); "
+            "print(publish_parts(source, writer_name='html4css1')['fragment'])"
+        )
+        output = subprocess.check_output([sys.executable, "-c", code])
+        self.assertEqual(output.count(b'<div class="highlight">'), 1)
+        self.assertEqual(output.count(b"literal-block"), 1)
+
     def test_plain_markup_urlize(self):
         for key, func, _ in DEFAULT_MARKUP_TYPES:
             if key != "plain":
@@ -293,6 +407,181 @@ class MarkupFieldTestCase(TestCase):
             break
 
 
+MARKDOWN_DOCUMENTS = [
+    "**markdown**",
+    "see [the docs][docs]\n\n[docs]: http://example.com",
+    "see [the docs][docs] again",
+    "* one\n* two\n\n        :::python\n        print('hi')\n",
+    "<div>raw *html*</div>\n\n# title\n\n1. one\n2. two",
+    "",
+]
+
+
+class MarkdownRendererTestCase(TestCase):
+    def setUp(self):
+        self.codehilite = "markdown.extensions.codehilite"
+        self.config = {self.codehilite: {"css_class": "highlight"}}
+        self.renderer = MarkdownRenderer(
+            extensions=[self.codehilite], extension_configs=self.config
+        )
+
+    def expected(self, text):
+        import markdown
+
+        return markdown.markdown(
+            text, extensions=[self.codehilite], extension_configs=self.config
+        )
+
+    def test_same_output(self):
+        # rendered twice to check no state leaks from one document to the next
+        for text in MARKDOWN_DOCUMENTS * 2:
+            self.assertEqual(self.renderer(text), self.expected(text))
+
+    def test_default_renderer(self):
+        renderer = dict((mc[0], mc[1]) for mc in DEFAULT_MARKUP_TYPES)["markdown"]
+        for text in MARKDOWN_DOCUMENTS:
+            self.assertEqual(renderer(text), self.expected(text))
+
+    def test_threads(self):
+        documents = MARKDOWN_DOCUMENTS * 20
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            rendered = list(executor.map(self.renderer, documents))
+        self.assertEqual(rendered, [self.expected(text) for text in documents])
+
+    def test_instance_per_thread(self):
+        md = self.renderer.get_markdown()
+        self.assertIs(self.renderer.get_markdown(), md)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            other = executor.submit(self.renderer.get_markdown).result()
+        self.assertIsNot(other, md)
+
+
+REST_DOCUMENTS = [
+    "*ReST*",
+    "Title\n=====\n\nSub\n---\n\ntext",
+    "Para [#]_\n\n.. [#] a footnote",
+    "`a link`_\n\n.. _a link: http://example.com",
+    ".. |sub| replace:: substituted\n\n|sub|",
+    ".. note:: admonition\n\n* one\n* two",
+]
+
+
+class RestRendererTestCase(TestCase):
+    def expected(self, text, **overrides):
+        from docutils.core import publish_parts
+
+        overrides.update({"raw_enabled": False, "file_insertion_enabled": False})
+        return publish_parts(
+            source=text, writer_name="html4css1", settings_overrides=overrides
+        )["fragment"]
+
+    def test_same_output(self):
+        renderer = RestRenderer()
+        for text in REST_DOCUMENTS * 2:
+            self.assertEqual(renderer(text), self.expected(text))
+
+    def test_threads(self):
+        renderer = RestRenderer()
+        documents = REST_DOCUMENTS * 10
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            rendered = list(executor.map(renderer, documents))
+        self.assertEqual(rendered, [self.expected(text) for text in documents])
+
+    def test_code_directive(self):
+        from markupfield.markup import PYGMENTS_INSTALLED, _get_lexer
+
+        if not PYGMENTS_INSTALLED:
+            self.skipTest("pygments is not installed")
+        renderer = dict((mc[0], mc[1]) for mc in DEFAULT_MARKUP_TYPES)[
+            "restructuredtext"
+        ]
+        code = ".. code:: python\n%s\n   print(1)\n"
+        self.assertIn('<span class="nb">print</span>', renderer(code % ""))
+        self.assertNotIn("linenos", renderer(code % ""))
+        with_linenos = renderer(code % "   :linenos:\n")
+        self.assertIn('class="linenos"', with_linenos)
+        self.assertIn('<span class="nb">print</span>', with_linenos)
+        # unknown languages fall back to plain text
+        self.assertIn("print(1)", renderer(".. code:: nosuchlanguage\n\n   print(1)\n"))
+        self.assertIs(_get_lexer("python"), _get_lexer("python"))
+
+    def test_settings_overrides(self):
+        filter_settings = {"initial_header_level": 3, "doctitle_xform": False}
+        with self.settings(RESTRUCTUREDTEXT_FILTER_SETTINGS=filter_settings):
+            renderer = dict((mc[0], mc[1]) for mc in DEFAULT_MARKUP_TYPES)[
+                "restructuredtext"
+            ]
+            text = "Title\n=====\n\ntext"
+            self.assertEqual(
+                renderer(text),
+                self.expected(text, initial_header_level=3, doctitle_xform=False),
+            )
+            self.assertIn("<h3>", renderer(text))
+            # the setting itself is left alone
+            self.assertNotIn("raw_enabled", filter_settings)
+        self.assertNotIn("<h3>", renderer(text))
+
+
+class BatchRenderTestCase(TestCase):
+    def setUp(self):
+        del BATCH_CALLS[:]
+        del RENDER_CALLS[:]
+        self.field = CountedPost._meta.get_field("body")
+
+    def test_default_renderers(self):
+        documents = MARKDOWN_DOCUMENTS + REST_DOCUMENTS
+        for _, renderer, _ in DEFAULT_MARKUP_TYPES:
+            self.assertEqual(
+                list(render_many(renderer, iter(documents))),
+                [renderer(text) for text in documents],
+            )
+
+    def test_callable_fallback(self):
+        self.assertEqual(list(render_many(counting_render, ["a", "b"])), ["A", "B"])
+        self.assertEqual(RENDER_CALLS, ["a", "b"])
+
+    def test_render_markup_many(self):
+        self.assertEqual(
+            self.field.render_markup_many(["a b", None, "c"], "title"),
+            ["A B", None, "C"],
+        )
+        self.assertEqual(BATCH_CALLS, [["a b", "c"]])
+        self.assertEqual(self.field.render_markup_many([], "title"), [])
+
+    @override_settings(MARKUP_FIELD_RENDER_CACHE="lru")
+    def test_render_markup_many_cached(self):
+        self.field.render_markup_many(["a", "b"], "title")
+        self.assertEqual(self.field.render_markup_many(["b", "c"], "title"), ["B", "C"])
+        self.assertEqual(BATCH_CALLS, [["a", "b"], ["c"]])
+
+    def test_bulk_update(self):
+        posts = [
+            CountedPost.objects.create(body="post %d" % n, body_markup_type="title")
+            for n in range(3)
+        ]
+        posts.append(CountedPost.objects.create(body="upper"))
+        del BATCH_CALLS[:]
+        del RENDER_CALLS[:]
+        for post in posts:
+            post.body = post.body.raw + " changed"
+        CountedPost.objects.bulk_update(posts, ["body"])
+        self.assertEqual(
+            BATCH_CALLS, [["post 0 changed", "post 1 changed", "post 2 changed"]]
+        )
+        self.assertEqual(RENDER_CALLS, ["upper changed"])
+
+    def test_rerender_command(self):
+        for n in range(3):
+            CountedPost.objects.create(body="post %d" % n, body_markup_type="title")
+        CountedPost.objects.update(_body_rendered="")
+        del BATCH_CALLS[:]
+        call_command("rerender_markup", "tests.CountedPost", stdout=StringIO())
+        self.assertEqual(BATCH_CALLS, [["post 0", "post 1", "post 2"]])
+        self.assertEqual(
+            CountedPost.objects.filter(_body_rendered__startswith="Post").count(), 3
+        )
+
+
 class MarkupWidgetTests(TestCase):
     def test_markuptextarea_used(self):
         self.assertTrue(isinstance(MarkupField().formfield().widget, MarkupTextarea))
@@ -484,3 +773,1478 @@ class MarkupDescriptorTestCase(TestCase):
         """
         self.assertIsInstance(Post.body, MarkupDescriptor)
         self.assertIs(Post._meta.get_field("body"), Post.body.field)
+
+    def test_cached_markup(self):
+        post = Post(title="post", body="*text*", body_markup_type="markdown")
+        markup = post.body
+        self.assertIs(post.body, markup)
+        self.assertFalse(hasattr(markup, "__dict__"))
+        post.body = "changed"
+        self.assertIsNot(post.body, markup)
+        self.assertEqual(markup.raw, "changed")
+        # a copy gets its own Markup
+        other = copy.copy(post)
+        self.assertIs(other.body.instance, other)
+        other.body = "other"
+        self.assertEqual(post.body.raw, "changed")
+
+    def test_access_allocations(self):
+        post = Post(title="post", body="*text*", body_markup_type="markdown")
+        post.body
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            proxies = [post.body for _ in range(1000)]
+            allocated = tracemalloc.get_traced_memory()[0] - before
+        finally:
+            tracemalloc.stop()
+        # nothing but the list, not a Markup per access
+        self.assertLess(allocated, sys.getsizeof(proxies) + 1024)
+        self.assertEqual(len(set(map(id, proxies))), 1)
+
+
+class SkipRenderTestCase(TestCase):
+    def setUp(self):
+        del RENDER_CALLS[:]
+        self.post = CountedPost.objects.create(title="title", body="text")
+
+    def test_render_on_create(self):
+        self.assertEqual(RENDER_CALLS, ["text"])
+        self.assertEqual(self.post.body.rendered, "TEXT")
+
+    def test_unchanged_save(self):
+        self.post.title = "new title"
+        self.post.save()
+        self.assertEqual(RENDER_CALLS, ["text"])
+
+    def test_unchanged_save_from_database(self):
+        post = CountedPost.objects.get(pk=self.post.pk)
+        post.title = "new title"
+        post.save()
+        self.assertEqual(RENDER_CALLS, ["text"])
+        self.assertEqual(CountedPost.objects.get(pk=post.pk).body.rendered, "TEXT")
+
+    def test_unchanged_save_of_subclasses(self):
+        child = ChildCountedPost.objects.create(title="child", body="child")
+        for post in [
+            ProxyCountedPost.objects.get(pk=self.post.pk),
+            ChildCountedPost.objects.get(pk=child.pk),
+        ]:
+            post.title = "new title"
+            post.save()
+        self.assertEqual(RENDER_CALLS, ["text", "child"])
+
+    def test_changed_raw(self):
+        post = CountedPost.objects.get(pk=self.post.pk)
+        post.body.raw = "changed"
+        post.save()
+        self.assertEqual(RENDER_CALLS, ["text", "changed"])
+        self.assertEqual(post.body.rendered, "CHANGED")
+
+    def test_changed_markup_type(self):
+        post = CountedPost.objects.get(pk=self.post.pk)
+        post.body.markup_type = "lower"
+        post.save()
+        self.assertEqual(post.body.rendered, "text")
+
+    def test_update_fields(self):
+        post = CountedPost.objects.get(pk=self.post.pk)
+        post.title = "new title"
+        post.body.raw = "changed"
+        post.save(update_fields=["title"])
+        self.assertEqual(RENDER_CALLS, ["text"])
+
+    def test_new_instance_with_pk(self):
+        # the rendered default of a new instance is never trusted
+        post = CountedPost(pk=self.post.pk, title="title", body="text")
+        post.save()
+        self.assertEqual(RENDER_CALLS, ["text", "text"])
+        self.assertEqual(post.body.rendered, "TEXT")
+
+    def test_markup_assignment(self):
+        post = CountedPost.objects.get(pk=self.post.pk)
+        post.body = CountedPost(body="text").body
+        post.save()
+        self.assertEqual(RENDER_CALLS, ["text", "text"])
+        self.assertEqual(post.body.rendered, "TEXT")
+
+    def test_refresh_from_db(self):
+        post = CountedPost.objects.get(pk=self.post.pk)
+        # saved by another process
+        CountedPost(pk=self.post.pk, title="title", body="other").save()
+        for fields in [None, ["_body_rendered"]]:
+            post.refresh_from_db(fields=fields)
+            self.assertEqual(post.body.rendered, "OTHER")
+            # the rendered value belongs to "other" now
+            post.body = "text"
+            post.save()
+            self.assertEqual(
+                CountedPost.objects.values_list("body", "_body_rendered").get(),
+                ("text", "TEXT"),
+            )
+            CountedPost.objects.update(body="other", _body_rendered="OTHER")
+
+
+class RerenderMarkupCommandTestCase(TestCase):
+    def setUp(self):
+        self.posts = [
+            CountedPost.objects.create(title="post %d" % n, body="text %d" % n)
+            for n in range(5)
+        ]
+        CountedPost.objects.update(_body_rendered="stale")
+
+    def rerender(self, *args, **kwargs):
+        out = StringIO()
+        call_command("rerender_markup", "tests.CountedPost", *args, stdout=out, **kwargs)
+        return out.getvalue()
+
+    def rendered(self):
+        return list(
+            CountedPost.objects.order_by("pk").values_list("_body_rendered", flat=True)
+        )
+
+    def test_rerender(self):
+        out = self.rerender()
+        self.assertEqual(self.rendered(), ["TEXT %d" % n for n in range(5)])
+        self.assertIn("tests.CountedPost.body: 5 rows rendered, 5 changed", out)
+
+    def test_unchanged_rows(self):
+        self.rerender()
+        out = self.rerender()
+        self.assertIn("5 rows rendered, 0 changed", out)
+
+    def test_dry_run(self):
+        out = self.rerender(dry_run=True)
+        self.assertEqual(self.rendered(), ["stale"] * 5)
+        self.assertIn("5 would change", out)
+
+    def test_start_after(self):
+        self.rerender(batch_size=2, start_after=self.posts[2].pk)
+        self.assertEqual(self.rendered(), ["stale"] * 3 + ["TEXT 3", "TEXT 4"])
+
+    def test_start_after_multiple_models(self):
+        with self.assertRaises(CommandError):
+            call_command("rerender_markup", "tests", start_after=1)
+
+    def test_workers(self):
+        self.rerender(batch_size=3, workers=2)
+        self.assertEqual(self.rendered(), ["TEXT %d" % n for n in range(5)])
+
+    def test_rows_hidden_by_default_manager(self):
+        post = PublishedPost.objects.create(body="draft")
+        PublishedPost._base_manager.update(_body_rendered="stale")
+        call_command("rerender_markup", "tests.PublishedPost", stdout=StringIO())
+        self.assertEqual(
+            PublishedPost._base_manager.get(pk=post.pk)._body_rendered, "DRAFT"
+        )
+
+
+class RenderCacheTestCase(TestCase):
+    def setUp(self):
+        del RENDER_CALLS[:]
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(get_render_cache())
+
+    @override_settings(MARKUP_FIELD_RENDER_CACHE="lru")
+    def test_shared_across_rows(self):
+        CountedPost.objects.create(title="one", body="same")
+        post = CountedPost.objects.create(title="two", body="same")
+        self.assertEqual(RENDER_CALLS, ["same"])
+        self.assertEqual(post.body.rendered, "SAME")
+        self.assertEqual(get_render_cache().stats()["hits"], 1)
+
+    @override_settings(MARKUP_FIELD_RENDER_CACHE="lru")
+    def test_key_includes_escape_html(self):
+        Post.objects.create(
+            body="<b>", body_markup_type="markdown", comment="<b>", title="p"
+        )
+        post = Post.objects.get()
+        self.assertEqual(post.body.rendered, "<p><b></p>")
+        self.assertEqual(post.comment.rendered, "<p>&lt;b&gt;</p>")
+
+    @override_settings(
+        MARKUP_FIELD_RENDER_CACHE="default",
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        },
+    )
+    def test_django_cache(self):
+        CountedPost.objects.create(title="one", body="same")
+        CountedPost.objects.create(title="two", body="same")
+        self.assertEqual(RENDER_CALLS, ["same"])
+        self.assertEqual(get_render_cache().stats(), {"hits": 1, "misses": 1})
+
+    def test_lru_eviction(self):
+        cache = LRURenderCache(max_size=10)
+        cache.set("a", "12345")
+        cache.set("b", "12345")
+        cache.get("a")
+        cache.set("c", "12345")
+        self.assertEqual(cache.get("a"), "12345")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.size, 10)
+        self.assertEqual(cache.stats()["hits"], 2)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def assert_renderers_apart(self):
+        for markup_type, raw in [("markdown", "# Head"), ("flag", "ab")]:
+            post = ConfiguredRendererPost.objects.create(
+                plain=raw,
+                plain_markup_type=markup_type,
+                toc=raw,
+                toc_markup_type=markup_type,
+            )
+            post = ConfiguredRendererPost.objects.get(pk=post.pk)
+            self.assertNotEqual(post.plain.rendered, post.toc.rendered)
+        self.assertEqual(post.plain.rendered, "ab")
+        self.assertEqual(post.toc.rendered, "AB")
+
+    @override_settings(MARKUP_FIELD_RENDER_CACHE="lru")
+    def test_configured_renderers_lru(self):
+        self.assert_renderers_apart()
+
+    @override_settings(
+        MARKUP_FIELD_RENDER_CACHE="default",
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        },
+    )
+    def test_configured_renderers_django_cache(self):
+        self.assert_renderers_apart()
+        # the flag renderers aren't cached at all
+        self.assertEqual(get_render_cache().stats(), {"hits": 0, "misses": 2})
+
+    def test_identifiable(self):
+        fields = [ConfiguredRendererPost._meta.get_field(n) for n in ("plain", "toc")]
+        plain, toc = [f.markup_choices_dict["markdown"] for f in fields]
+        self.assertTrue(is_identifiable(plain))
+        self.assertNotEqual(renderer_identity(plain), renderer_identity(toc))
+        self.assertFalse(is_identifiable(fields[0].markup_choices_dict["flag"]))
+        self.assertTrue(is_identifiable(counting_render))
+        self.assertTrue(is_identifiable(MarkdownRenderer()))
+
+    def test_renderer_identity(self):
+        html, plain = [mc[1] for mc in DEFAULT_MARKUP_TYPES[:2]]
+        self.assertNotEqual(renderer_identity(html), renderer_identity(plain))
+        counting_render.version = "2"
+        try:
+            self.assertTrue(renderer_identity(counting_render).endswith("@2"))
+        finally:
+            del counting_render.version
+
+
+class DeferredRenderTestCase(TestCase):
+    def setUp(self):
+        del RENDER_CALLS[:]
+        del DEFERRED_RENDERS[:]
+
+    def create(self, body="text"):
+        with self.captureOnCommitCallbacks(execute=True):
+            return DeferredPost.objects.create(body=body)
+
+    def test_render_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            post = DeferredPost.objects.create(body="text")
+        self.assertEqual(RENDER_CALLS, [])
+        self.assertIsNone(DeferredPost.objects.get().__dict__["_body_rendered"])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(DEFERRED_RENDERS, [("tests.DeferredPost", post.pk, "body")])
+        self.assertEqual(DeferredPost.objects.get().body.rendered, "TEXT")
+        self.assertEqual(RENDER_CALLS, ["text"])
+
+    def test_stale_access_renders(self):
+        with self.captureOnCommitCallbacks():
+            post = DeferredPost.objects.create(body="text")
+        self.assertEqual(post.body.rendered, "TEXT")
+        self.assertEqual(str(DeferredPost.objects.get().body), "TEXT")
+        # the synchronous render is saved along with the instance
+        post.save()
+        self.assertEqual(DeferredPost.objects.get()._body_rendered, "TEXT")
+
+    def test_unchanged_save(self):
+        self.create()
+        post = DeferredPost.objects.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            post.save()
+        self.assertEqual(len(DEFERRED_RENDERS), 1)
+        self.assertEqual(RENDER_CALLS, ["text"])
+
+    def test_changed_save(self):
+        self.create()
+        post = DeferredPost.objects.get()
+        post.body.raw = "changed"
+        with self.captureOnCommitCallbacks(execute=True):
+            post.save()
+        self.assertEqual(DeferredPost.objects.get()._body_rendered, "CHANGED")
+
+    def test_renders_current_value(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            post = DeferredPost.objects.create(body="text")
+        DeferredPost.objects.update(body="changed")
+        for callback in callbacks:
+            callback()
+        self.assertEqual(DeferredPost.objects.get(pk=post.pk)._body_rendered, "CHANGED")
+
+    def test_invalid_render_mode(self):
+        self.assertRaises(ValueError, MarkupField, render_mode="later")
+
+
+class DeferredRenderAutocommitTestCase(TransactionTestCase):
+    # outside of a transaction on_commit() callbacks run right away
+
+    def setUp(self):
+        del RENDER_CALLS[:]
+        del DEFERRED_RENDERS[:]
+
+    def stored(self):
+        return DeferredPost.objects.values_list("body", "_body_rendered").get()
+
+    def test_create(self):
+        post = DeferredPost.objects.create(body="text")
+        self.assertEqual(DEFERRED_RENDERS, [("tests.DeferredPost", post.pk, "body")])
+        self.assertEqual(self.stored(), ("text", "TEXT"))
+
+    def test_changed_save(self):
+        post = DeferredPost.objects.create(body="text")
+        post.body = "changed"
+        post.save()
+        self.assertEqual(self.stored(), ("changed", "CHANGED"))
+        self.assertEqual(RENDER_CALLS, ["text", "changed"])
+
+    def test_unchanged_save(self):
+        post = DeferredPost.objects.create(body="text")
+        post.save()
+        post.body = "text"
+        post.save()
+        # the finished render isn't overwritten or scheduled again
+        self.assertEqual(self.stored(), ("text", "TEXT"))
+        self.assertEqual(len(DEFERRED_RENDERS), 1)
+        self.assertNotIn("_body_rendered", post.__dict__)
+        self.assertEqual(post.body.rendered, "TEXT")
+        self.assertEqual(RENDER_CALLS, ["text"])
+
+    def test_unchanged_save_leaves_rendered_out(self):
+        post = DeferredPost.objects.create(body="text")
+        with CaptureQueriesContext(connection) as queries:
+            post.save()
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn("_body_rendered", queries[0]["sql"])
+        # nothing but plain values on the instance, even if the save fails
+        with mock.patch.object(DeferredPost, "_do_update", side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                post.save()
+        self.assertNotIn("_body_rendered", post.__dict__)
+        self.assertEqual(post.body.rendered, "TEXT")
+
+    def bulk_create(self, **kwargs):
+        DeferredPost.objects.bulk_create(
+            [DeferredPost(body="a"), DeferredPost(body="b")], **kwargs
+        )
+        return list(
+            DeferredPost.objects.order_by("body").values_list("_body_rendered", flat=True)
+        )
+
+    def test_bulk_create(self):
+        self.assertEqual(self.bulk_create(), ["A", "B"])
+
+    def test_bulk_create_without_pks(self):
+        # e.g. MySQL: the inserted rows can't be found, they are rendered first
+        with mock.patch.object(
+            type(connection.features), "can_return_rows_from_bulk_insert", False
+        ):
+            self.assertEqual(self.bulk_create(), ["A", "B"])
+        self.assertEqual(DEFERRED_RENDERS, [])
+        DeferredPost.objects.all().delete()
+        self.assertEqual(self.bulk_create(ignore_conflicts=True), ["A", "B"])
+        self.assertEqual(DEFERRED_RENDERS, [])
+
+
+class AsyncRenderTestCase(TestCase):
+    def setUp(self):
+        del RENDER_CALLS[:]
+
+    async def test_arender(self):
+        post = CountedPost(body="text")
+        self.assertEqual(await post.body.arender(), "TEXT")
+        self.assertEqual(post.body.rendered, "TEXT")
+        # already rendered
+        self.assertEqual(await post.body.arender(), "TEXT")
+        self.assertEqual(RENDER_CALLS, ["text"])
+
+    async def test_invalid_markup_type(self):
+        post = CountedPost(body="text", body_markup_type="nope")
+        with self.assertRaises(ValueError):
+            await post.body.arender()
+
+    async def test_event_loop_responsive(self):
+        posts = [CountedPost(body="post %d" % n, body_markup_type="slow") for n in range(4)]
+        ticks = []
+
+        async def ticker():
+            while True:
+                await asyncio.sleep(0.01)
+                ticks.append(None)
+
+        task = asyncio.ensure_future(ticker())
+        started = time.monotonic()
+        await arender_instances(posts)
+        elapsed = time.monotonic() - started
+        task.cancel()
+
+        self.assertEqual([p.body.rendered for p in posts], ["POST %d" % n for n in range(4)])
+        # the loop kept running and the renders ran concurrently
+        self.assertGreater(len(ticks), 5)
+        self.assertLess(elapsed, 0.6)
+
+    @override_settings(MARKUP_FIELD_ASYNC_CONCURRENCY=1)
+    async def test_concurrency_limit(self):
+        posts = [CountedPost(body="post %d" % n, body_markup_type="slow") for n in range(2)]
+        started = time.monotonic()
+        await arender_instances(posts)
+        self.assertGreaterEqual(time.monotonic() - started, 0.4)
+
+    async def test_abulk_create(self):
+        if not hasattr(CountedPost.objects, "abulk_create"):
+            self.skipTest("async ORM bulk_create requires Django 4.1")
+        posts = [CountedPost(body="post %d" % n) for n in range(3)]
+        await arender_instances(posts)
+        await CountedPost.objects.abulk_create(posts)
+        self.assertEqual(len(RENDER_CALLS), 3)
+        self.assertEqual(
+            await CountedPost.objects.filter(_body_rendered="POST 1").acount(), 1
+        )
+
+
+class MarkupQuerySetTestCase(TestCase):
+    def setUp(self):
+        self.posts = [
+            CountedPost.objects.create(title="post %d" % n, body="text %d" % n)
+            for n in range(3)
+        ]
+        del RENDER_CALLS[:]
+
+    def rendered(self):
+        return list(
+            CountedPost.objects.order_by("pk").values_list("_body_rendered", flat=True)
+        )
+
+    def test_bulk_update(self):
+        self.posts[0].body = "changed"
+        self.posts[1].body.markup_type = "lower"
+        self.posts[2].title = "new title"
+        CountedPost.objects.bulk_update(self.posts, ["body", "title"])
+        self.assertEqual(self.rendered(), ["CHANGED", "text 1", "TEXT 2"])
+        self.assertEqual(RENDER_CALLS, ["changed"])
+        self.assertEqual(CountedPost.objects.get(pk=self.posts[1].pk).body_markup_type, "lower")
+
+    def test_bulk_update_executor(self):
+        for post in self.posts:
+            post.body = post.body.raw + "!"
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            CountedPost.objects.bulk_update(self.posts, ["body"], executor=executor)
+        self.assertEqual(self.rendered(), ["TEXT 0!", "TEXT 1!", "TEXT 2!"])
+
+    def test_bulk_update_other_fields(self):
+        self.posts[0].title = "new title"
+        CountedPost.objects.bulk_update(self.posts, ["title"])
+        self.assertEqual(RENDER_CALLS, [])
+
+    def test_bulk_create_executor(self):
+        posts = [CountedPost(body="new %d" % n) for n in range(3)]
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            CountedPost.objects.bulk_create(posts, executor=executor)
+        self.assertEqual(len(RENDER_CALLS), 3)
+        self.assertEqual(
+            CountedPost.objects.filter(_body_rendered__startswith="NEW").count(), 3
+        )
+
+    def test_update(self):
+        self.assertEqual(CountedPost.objects.update(body="same"), 3)
+        self.assertEqual(self.rendered(), ["SAME"] * 3)
+        self.assertEqual(RENDER_CALLS, ["same"])
+
+    def test_update_markup_types(self):
+        CountedPost.objects.filter(pk=self.posts[0].pk).update(body_markup_type="lower")
+        self.assertEqual(self.rendered(), ["text 0", "TEXT 1", "TEXT 2"])
+        self.assertEqual(CountedPost.objects.update(body="Same"), 3)
+        self.assertEqual(self.rendered(), ["same", "SAME", "SAME"])
+
+    def test_update_raw_and_markup_type(self):
+        CountedPost.objects.update(body="Same", body_markup_type="lower")
+        self.assertEqual(self.rendered(), ["same"] * 3)
+        self.assertEqual(RENDER_CALLS, [])
+
+    def test_update_expression(self):
+        from django.db.models import F
+
+        with self.assertRaises(ValueError):
+            CountedPost.objects.update(body=F("title"))
+
+    def test_update_other_fields(self):
+        CountedPost.objects.update(title="same")
+        self.assertEqual(RENDER_CALLS, [])
+
+
+class DeferredLoadingTestCase(TestCase):
+    def setUp(self):
+        self.post = CountedPost.objects.create(title="post", body="text")
+        del RENDER_CALLS[:]
+
+    def test_only(self):
+        post = CountedPost.objects.only("title").get()
+        with self.assertNumQueries(1):
+            self.assertEqual(post.body.raw, "text")
+        with self.assertNumQueries(2):
+            self.assertEqual(post.body.markup_type, "upper")
+            self.assertEqual(post.body.rendered, "TEXT")
+        post.title = "changed"
+        post.save()
+        self.assertEqual(CountedPost.objects.get().title, "changed")
+
+    def test_defer_raw(self):
+        post = CountedPost.objects.defer_raw().get()
+        self.assertEqual(post.get_deferred_fields(), {"body", "body_markup_type"})
+        with self.assertNumQueries(0):
+            self.assertEqual(str(post.body), "TEXT")
+        with self.assertNumQueries(1):
+            self.assertEqual(post.body.raw, "text")
+
+    def test_defer_rendered(self):
+        post = CountedPost.objects.defer_rendered("body").get()
+        self.assertEqual(post.get_deferred_fields(), {"_body_rendered"})
+        with self.assertNumQueries(0):
+            self.assertEqual(post.body.raw, "text")
+            self.assertEqual(post.body.markup_type, "upper")
+        with self.assertNumQueries(1):
+            self.assertEqual(post.body.rendered, "TEXT")
+
+    def test_unknown_field(self):
+        with self.assertRaises(ValueError):
+            CountedPost.objects.defer_raw("title")
+
+    def test_save_without_rendered(self):
+        post = CountedPost.objects.defer_rendered().get()
+        post.body = "changed"
+        post.save()
+        self.assertEqual(CountedPost.objects.get().body.rendered, "CHANGED")
+
+        post = CountedPost.objects.defer_rendered().get()
+        post.body.markup_type = "lower"
+        post.save()
+        self.assertEqual(CountedPost.objects.get().body.rendered, "changed")
+        self.assertEqual(RENDER_CALLS, ["changed"])
+
+    def test_save_without_raw(self):
+        post = CountedPost.objects.defer_raw().get()
+        post.title = "changed"
+        post.save()
+        self.assertEqual(RENDER_CALLS, [])
+        post.body = "changed"
+        post.save()
+        self.assertEqual(CountedPost.objects.get().body.rendered, "CHANGED")
+
+
+class StoredTextTestCase(TestCase):
+    def setUp(self):
+        self.post = SearchPost.objects.create(
+            body="# Title\n\nSome *markdown* &amp; a [link](http://example.com)."
+        )
+
+    def test_html_to_text(self):
+        self.assertEqual(
+            html_to_text("<p>one&lt;<b>two</b></p><ul><li>3</li><li>4</li></ul>"),
+            "one<two 3 4",
+        )
+        self.assertEqual(html_to_text("a<script>b</script><style>c</style>d"), "ad")
+
+    def test_save(self):
+        post = SearchPost.objects.get()
+        self.assertEqual(post.body.text, "Title Some markdown & a link.")
+        self.assertEqual(post.body.excerpt, "Title Some markdown…")
+        self.assertEqual(len(post.body.excerpt), 20)
+
+    def test_searchable_content(self):
+        field = SearchPost._meta.get_field("body")
+        self.assertEqual(
+            field.get_searchable_content(self.post.body), "Title Some markdown & a link."
+        )
+
+    def test_deconstruct(self):
+        kwargs = SearchPost._meta.get_field("body").deconstruct()[3]
+        self.assertTrue(kwargs["store_text"])
+        self.assertEqual(kwargs["excerpt_length"], 20)
+
+    def test_update(self):
+        SearchPost.objects.update(body="*new*")
+        self.assertEqual(SearchPost.objects.get().body.text, "new")
+        SearchPost.objects.update(body_markup_type="plain")
+        self.assertEqual(SearchPost.objects.get().body.excerpt, "*new*")
+
+    def test_bulk_update(self):
+        self.post.body = "changed"
+        SearchPost.objects.bulk_update([self.post], ["body"])
+        post = SearchPost.objects.get()
+        self.assertEqual((post.body.text, post.body.excerpt), ("changed", "changed"))
+
+    def test_defer_rendered(self):
+        post = SearchPost.objects.defer_rendered().get()
+        self.assertEqual(
+            post.get_deferred_fields(), {"_body_rendered", "_body_text", "_body_excerpt"}
+        )
+        post.body = "changed"
+        post.save()
+        self.assertEqual(SearchPost.objects.get().body.text, "changed")
+
+    def test_rerender_command(self):
+        SearchPost.objects.update(_body_text="", _body_excerpt="")
+        call_command("rerender_markup", "tests.SearchPost", stdout=StringIO())
+        post = SearchPost.objects.get()
+        self.assertEqual(post.body.text, "Title Some markdown & a link.")
+        self.assertEqual(post.body.excerpt, "Title Some markdown…")
+
+
+class CompressedRenderedTestCase(TestCase):
+    text = "* item with *emphasis*\n" * 50
+
+    def stored(self, post):
+        from django.db import connection
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT _body_rendered FROM tests_compressedpost WHERE id = %s",
+                [post.pk],
+            )
+            return bytes(cursor.fetchone()[0])
+
+    def set_stored(self, post, value):
+        from django.db import connection
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE tests_compressedpost SET _body_rendered = %s WHERE id = %s",
+                [value, post.pk],
+            )
+
+    def test_roundtrip(self):
+        for text in ["", "short", "\x00z", self.text]:
+            self.assertEqual(compression.decompress(compression.compress(text)), text)
+        if compression.ZSTD_INSTALLED:
+            data = compression.compress(self.text, "zstd")
+            self.assertEqual(compression.decompress(data), self.text)
+
+    def test_compressed(self):
+        post = CompressedPost.objects.create(body=self.text)
+        stored = self.stored(post)
+        self.assertTrue(stored.startswith(compression.ZLIB_PREFIX))
+        rendered = CompressedPost.objects.get().body.rendered
+        self.assertEqual(rendered, post.body.rendered)
+        self.assertTrue(rendered.startswith("<ul>"))
+        self.assertLess(len(stored), len(rendered.encode("utf-8")) / 4)
+
+    def test_short_values_uncompressed(self):
+        post = CompressedPost.objects.create(body="*short*")
+        self.assertEqual(self.stored(post), b"<p><em>short</em></p>")
+        self.assertEqual(CompressedPost.objects.get().body.rendered, "<p><em>short</em></p>")
+
+    def test_uncompressed_values(self):
+        post = CompressedPost.objects.create(body=self.text)
+        rendered = post.body.rendered
+        # as left by a migration from a TextField
+        for value in [rendered, rendered.encode("utf-8")]:
+            self.set_stored(post, value)
+            self.assertEqual(CompressedPost.objects.get().body.rendered, rendered)
+
+        call_command("rerender_markup", "tests.CompressedPost", stdout=StringIO())
+        self.assertFalse(self.stored(post).startswith(compression.ZLIB_PREFIX))
+        call_command(
+            "rerender_markup", "tests.CompressedPost", "--force", stdout=StringIO()
+        )
+        self.assertTrue(self.stored(post).startswith(compression.ZLIB_PREFIX))
+
+    def test_serialization(self):
+        CompressedPost.objects.create(body="*text*")
+        data = json.loads(serializers.serialize("json", CompressedPost.objects.all()))
+        self.assertEqual(data[0]["fields"]["_body_rendered"], "<p><em>text</em></p>")
+        obj = next(serializers.deserialize("json", json.dumps(data)))
+        self.assertEqual(obj.object.body.rendered, "<p><em>text</em></p>")
+
+    def test_invalid_codec(self):
+        with self.assertRaises(ValueError):
+            MarkupField(compress_rendered="lzma")
+
+    def test_default_codec(self):
+        # the same codec and migration whether zstandard is installed or not
+        field = DefaultCompressedPost._meta.get_field("body")
+        self.assertIs(field.deconstruct()[3]["compress_rendered"], True)
+        rendered = DefaultCompressedPost._meta.get_field("_body_rendered")
+        self.assertEqual(rendered.codec, "zlib")
+
+
+class InstrumentationTestCase(TestCase):
+    def setUp(self):
+        render_stats.reset()
+        self.signals = []
+        markup_rendered.connect(self.receiver)
+        self.addCleanup(markup_rendered.disconnect, self.receiver)
+
+    def receiver(self, sender, **kwargs):
+        self.signals.append(dict(kwargs, sender=sender))
+
+    def test_signal(self):
+        post = CountedPost.objects.create(body="tëxt")
+        self.assertEqual(len(self.signals), 1)
+        signal = self.signals[0]
+        self.assertIs(signal["sender"], CountedPost)
+        self.assertIs(signal["field"], CountedPost._meta.get_field("body"))
+        self.assertIs(signal["instance"], post)
+        self.assertEqual(signal["markup_type"], "upper")
+        self.assertEqual((signal["raw_size"], signal["rendered_size"]), (5, 5))
+        self.assertGreaterEqual(signal["duration"], 0)
+
+    def test_stats(self):
+        CountedPost.objects.create(body="one")
+        CountedPost.objects.create(body="two", body_markup_type="lower")
+        CountedPost.objects.update(body="three")
+        stats = render_stats.snapshot()
+        self.assertEqual(stats["upper"]["count"], 2)
+        self.assertEqual(stats["upper"]["raw_bytes"], 8)
+        self.assertEqual(stats["lower"]["count"], 2)
+        self.assertEqual(stats["lower"]["rendered_bytes"], 8)
+        self.assertEqual(sum(count for _, count in stats["upper"]["histogram"]), 2)
+
+    def test_batch(self):
+        field = CountedPost._meta.get_field("body")
+        field.render_markup_many(["a", "b", None], "title")
+        self.assertEqual(render_stats.snapshot()["title"]["count"], 2)
+        self.assertEqual([signal["instance"] for signal in self.signals], [None, None])
+
+    @override_settings(MARKUP_FIELD_RENDER_CACHE="lru")
+    def test_cache_hits_not_recorded(self):
+        CountedPost.objects.create(body="same")
+        CountedPost.objects.create(body="same")
+        self.assertEqual(render_stats.snapshot()["upper"]["count"], 1)
+
+    def test_slow_render_warning(self):
+        post = CountedPost.objects.create(body="fast")
+        with self.settings(MARKUP_FIELD_SLOW_RENDER_THRESHOLD=0.1):
+            with self.assertLogs("markupfield", "WARNING") as logs:
+                post.body = "slow"
+                post.body.markup_type = "slow"
+                post.save()
+        self.assertIn(
+            "Slow render of tests.CountedPost (pk=%s) body as slow" % post.pk,
+            logs.output[0],
+        )
+
+
+class RenderLimitsTestCase(TestCase):
+    def setUp(self):
+        del RENDER_CALLS[:]
+
+    def test_supervised_render(self):
+        post = SupervisedPost.objects.create(body="text", strict="strict")
+        self.assertEqual(post.body.rendered, "TEXT")
+        self.assertEqual(post.strict.rendered, "STRICT")
+        # rendered in worker processes
+        self.assertEqual(RENDER_CALLS, [])
+
+    def test_timeout_escapes(self):
+        started = time.monotonic()
+        with self.assertLogs("markupfield", "WARNING"):
+            post = SupervisedPost.objects.create(
+                body="<b>hang</b> http://example.com", body_markup_type="hang"
+            )
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(
+            post.body.rendered,
+            '<p>&lt;b&gt;hang&lt;/b&gt; <a href="http://example.com">'
+            "http://example.com</a></p>",
+        )
+        # the next render gets a new worker
+        post.body.markup_type = "upper"
+        post.save()
+        self.assertEqual(post.body.rendered, "<B>HANG</B> HTTP://EXAMPLE.COM")
+
+    def test_worker_crash_escapes(self):
+        with self.assertLogs("markupfield", "WARNING"):
+            post = SupervisedPost.objects.create(body="<i>", body_markup_type="crash")
+        self.assertEqual(post.body.rendered, "<p>&lt;i&gt;</p>")
+
+    def test_broken_pipe_aborts(self):
+        # the process died before the document could be sent
+        field = SupervisedPost._meta.get_field("body")
+        worker = RenderWorker()
+        with mock.patch.object(
+            multiprocessing.connection.Connection, "send", side_effect=BrokenPipeError
+        ):
+            with self.assertRaises(RenderAborted):
+                worker.render(field, "upper", "text", 5)
+        self.assertIsNone(worker.process)
+        self.assertEqual(worker.render(field, "upper", "text", 5), "TEXT")
+        worker.stop()
+
+    def test_pathological_markdown(self):
+        # takes python-markdown over a minute
+        nested_list = "".join("  " * depth + "* a\n" for depth in range(2000))
+        started = time.monotonic()
+        with self.assertLogs("markupfield", "WARNING"):
+            post = SupervisedPost.objects.create(
+                body=nested_list, body_markup_type="markdown"
+            )
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertTrue(post.body.rendered.startswith("<p>* a<br>  * a<br>"))
+
+    def test_max_raw_length_escapes(self):
+        with self.assertLogs("markupfield", "WARNING"):
+            post = SupervisedPost.objects.create(body="<" * 101)
+        self.assertEqual(post.body.rendered, "<p>%s</p>" % ("&lt;" * 101))
+
+    def test_timeout_raises(self):
+        post = SupervisedPost(body="text", strict="text", strict_markup_type="hang")
+        with self.assertRaises(ValidationError) as cm:
+            post.full_clean()
+        self.assertEqual(cm.exception.error_dict["strict"][0].code, "render_timeout")
+        with self.assertRaises(ValidationError):
+            post.save()
+
+    def test_max_raw_length_raises(self):
+        post = SupervisedPost(body="text", strict="x" * 101)
+        with self.assertRaises(ValidationError) as cm:
+            post.full_clean()
+        self.assertEqual(cm.exception.error_dict["strict"][0].code, "max_raw_length")
+        # the limit is per markup type
+        post.strict.markup_type = "crash"
+        with self.assertRaises(ValidationError):
+            post.full_clean()
+        self.assertEqual(SupervisedPost.objects.count(), 0)
+
+    def test_full_clean_renders_once(self):
+        render_stats.reset()
+        post = SupervisedPost(body="text", strict="strict")
+        post.full_clean()
+        self.assertEqual(post.strict.rendered, "STRICT")
+        self.assertEqual(render_stats.snapshot()["upper"]["count"], 1)
+        post.save()
+        # only body is rendered by save()
+        self.assertEqual(render_stats.snapshot()["upper"]["count"], 2)
+
+    def test_invalid_fallback(self):
+        with self.assertRaises(ValueError):
+            MarkupField(render_fallback="ignore")
+
+
+INCREMENTAL_DOCUMENT = """# Title
+
+Intro with *emphasis*
+spanning lines.
+
+* a list
+
+    continued
+
+* item
+
+> a quote
+
+## Section
+
+```
+code
+
+Not a paragraph
+```
+
+Closing paragraph.
+"""
+
+
+class IncrementalRenderTestCase(TestCase):
+    def setUp(self):
+        del BLOCK_RENDERS[:]
+        del RENDER_CALLS[:]
+        get_block_cache().clear()
+
+    def full_render(self, raw):
+        return MarkdownRenderer(extensions=["fenced_code"])(raw)
+
+    def test_split_blocks(self):
+        blocks = MarkdownRenderer(extensions=["fenced_code"]).split_blocks(
+            INCREMENTAL_DOCUMENT
+        )
+        self.assertEqual(
+            [block.split("\n")[0] for block in blocks],
+            ["# Title", "Intro with *emphasis*", "## Section", "Closing paragraph."],
+        )
+        # the fenced code block isn't split
+        self.assertIn("Not a paragraph\n```", blocks[2])
+
+    def test_same_as_full_render(self):
+        post = IncrementalPost.objects.create(body=INCREMENTAL_DOCUMENT)
+        self.assertEqual(post.body.rendered, self.full_render(INCREMENTAL_DOCUMENT))
+        self.assertEqual(len(BLOCK_RENDERS), 4)
+
+    def test_renders_changed_blocks(self):
+        post = IncrementalPost.objects.create(body=INCREMENTAL_DOCUMENT)
+        del BLOCK_RENDERS[:]
+        raw = INCREMENTAL_DOCUMENT.replace("a quote", "a changed quote")
+        post.body = raw
+        post.save()
+        self.assertEqual(len(BLOCK_RENDERS), 1)
+        self.assertIn("a changed quote", BLOCK_RENDERS[0])
+        self.assertEqual(post.body.rendered, self.full_render(raw))
+        # a new row with known blocks doesn't render at all
+        del BLOCK_RENDERS[:]
+        IncrementalPost.objects.create(body=raw + "\n\n")
+        self.assertEqual(BLOCK_RENDERS, [])
+
+    def test_cross_block_constructs_render_whole(self):
+        raw = "A [link][1].\n\nMore text.\n\n[1]: http://example.com\n"
+        post = IncrementalPost.objects.create(body=raw)
+        self.assertEqual(BLOCK_RENDERS, [raw])
+        self.assertEqual(
+            post.body.rendered,
+            '<p>A <a href="http://example.com">link</a>.</p>\n<p>More text.</p>',
+        )
+        # as do documents with an unclosed fence
+        self.assertIsNone(MarkdownRenderer().split_blocks("text\n\n```\ncode"))
+        # and renderers with other extensions
+        self.assertIsNone(
+            MarkdownRenderer(extensions=["footnotes"]).split_blocks("text")
+        )
+
+    def test_escape_html(self):
+        raw = "<b>bold</b>\n\n# <i>title</i>"
+        post = IncrementalPost.objects.create(body="text", comment=raw)
+        self.assertEqual(
+            post.comment.rendered,
+            "<p>&lt;b&gt;bold&lt;/b&gt;</p>\n<h1>&lt;i&gt;title&lt;/i&gt;</h1>",
+        )
+
+    def test_renderers_without_blocks(self):
+        post = IncrementalPost.objects.create(
+            body="one\n\ntwo", body_markup_type="upper"
+        )
+        self.assertEqual(post.body.rendered, "ONE\n\nTWO")
+        self.assertEqual(RENDER_CALLS, ["one\n\ntwo"])
+
+    @override_settings(MARKUP_FIELD_RENDER_CACHE="lru")
+    def test_uses_render_cache(self):
+        self.assertIs(get_block_cache(), get_render_cache())
+        IncrementalPost.objects.create(body=INCREMENTAL_DOCUMENT)
+        # each block, the document and the empty comment
+        self.assertEqual(get_render_cache().stats()["entries"], 6)
+
+
+class RenderVersionTestCase(TestCase):
+    def setUp(self):
+        del RENDER_CALLS[:]
+        del DEFERRED_RENDERS[:]
+        self.posts = [
+            VersionedPost.objects.create(body="text %d" % n) for n in range(3)
+        ]
+        self.field = VersionedPost._meta.get_field("body")
+
+    def upgrade_renderer(self):
+        VERSIONED_RENDERER.version = "2"
+        self.addCleanup(setattr, VERSIONED_RENDERER, "version", "1")
+
+    def test_renderer_versions(self):
+        for markup_type, renderer, _ in DEFAULT_MARKUP_TYPES:
+            self.assertTrue(renderer.version, markup_type)
+        self.assertNotEqual(
+            MarkdownRenderer().version,
+            MarkdownRenderer(extensions=["nl2br"]).version,
+        )
+        self.assertEqual(
+            MarkdownRenderer(extensions=["nl2br"]).version,
+            MarkdownRenderer(extensions=["nl2br"]).version,
+        )
+
+    def test_stores_version(self):
+        post = VersionedPost.objects.get(pk=self.posts[0].pk)
+        self.assertEqual(post._body_version, self.field.get_render_version("upper"))
+        self.assertNotEqual(
+            post._body_version, self.field.get_render_version("lower")
+        )
+        post.body.markup_type = "lower"
+        post.save()
+        self.assertEqual(post._body_version, self.field.get_render_version("lower"))
+
+    def test_stale_markup(self):
+        self.assertFalse(VersionedPost.objects.stale_markup().exists())
+        # unknown versions are stale, e.g. rows from before store_version
+        VersionedPost.objects.filter(pk=self.posts[0].pk).update(_body_version=None)
+        self.assertEqual(
+            list(VersionedPost.objects.stale_markup("body")), [self.posts[0]]
+        )
+        self.upgrade_renderer()
+        self.assertEqual(VersionedPost.objects.stale_markup().count(), 3)
+        with self.assertRaises(ValueError):
+            CountedPost.objects.stale_markup()
+        with self.assertRaises(ValueError):
+            CountedPost.objects.stale_markup("body")
+
+    def test_rerender_stale_only(self):
+        VersionedPost.objects.filter(pk=self.posts[0].pk).update(_body_version=None)
+        del RENDER_CALLS[:]
+        out = StringIO()
+        call_command("rerender_markup", "tests", stale_only=True, stdout=out)
+        self.assertIn("tests.VersionedPost.body: 1 rows rendered, 1 changed", out.getvalue())
+        self.assertEqual(RENDER_CALLS, ["text 0"])
+        self.assertFalse(VersionedPost.objects.stale_markup().exists())
+
+        self.upgrade_renderer()
+        call_command("rerender_markup", "tests", stale_only=True, stdout=out)
+        self.assertEqual(len(RENDER_CALLS), 4)
+        self.assertFalse(VersionedPost.objects.stale_markup().exists())
+        with self.assertRaises(CommandError):
+            call_command("rerender_markup", "tests.CountedPost", stale_only=True)
+
+    def test_refresh_stale(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            str(VersionedPost.objects.get(pk=self.posts[0].pk).body)
+        self.assertEqual(DEFERRED_RENDERS, [])
+
+        self.upgrade_renderer()
+        with self.captureOnCommitCallbacks(execute=True):
+            post = VersionedPost.objects.get(pk=self.posts[0].pk)
+            # the loaded value is served while the refresh is pending
+            self.assertEqual(post.body.rendered, "TEXT 0")
+            str(post.body)
+        self.assertEqual(
+            DEFERRED_RENDERS, [("tests.VersionedPost", post.pk, "body")]
+        )
+        self.assertEqual(VersionedPost.objects.stale_markup().count(), 2)
+
+    def test_refresh_stale_requires_store_version(self):
+        with self.assertRaises(ValueError):
+            MarkupField(refresh_stale=True)
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class FragmentCacheTestCase(TestCase):
+    def setUp(self):
+        self.post = HashedPost.objects.create(body="*fragment*")
+        self.engine = Engine(
+            libraries={"markupfield_tags": "markupfield.templatetags.markupfield_tags"}
+        )
+
+    def render(self, post):
+        template = self.engine.from_string(
+            "{% load markupfield_tags %}{{ post.body|cached_markup }}"
+        )
+        return template.render(Context({"post": post}))
+
+    def test_stores_hash(self):
+        self.assertEqual(self.post._body_hash, rendered_hash("<p><em>fragment</em></p>"))
+        self.post.body = "changed"
+        self.post.save()
+        self.assertEqual(self.post._body_hash, rendered_hash("<p>changed</p>"))
+
+    def test_fingerprint(self):
+        post = HashedPost.objects.defer_rendered().get()
+        with self.assertNumQueries(0):
+            fingerprint = post.body.fingerprint
+        self.assertEqual(
+            fingerprint,
+            "tests.HashedPost:%s:body:%s" % (post.pk, self.post._body_hash),
+        )
+        # computed from the rendered value without store_hash
+        post = Post.objects.create(
+            title="post", body="*fragment*", body_markup_type="markdown"
+        )
+        self.assertEqual(
+            post.body.fingerprint,
+            "tests.Post:%s:body:%s" % (post.pk, self.post._body_hash),
+        )
+
+    def test_cached_markup(self):
+        self.assertEqual(self.render(self.post), "<p><em>fragment</em></p>")
+        post = HashedPost.objects.defer_rendered().get()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.render(post), "<p><em>fragment</em></p>")
+        self.assertNotIn("_body_rendered", post.__dict__)
+
+        HashedPost.objects.update(body="*changed*")
+        post = HashedPost.objects.defer_rendered().get()
+        self.assertEqual(self.render(post), "<p><em>changed</em></p>")
+
+    def test_markup_etag(self):
+        etag = markup_etag(self.post.body)
+        self.assertRegex(etag, r'^"[0-9a-f]{32}"$')
+        self.assertEqual(markup_etag(HashedPost.objects.get().body), etag)
+        self.post.body = "changed"
+        self.post.save()
+        self.assertNotEqual(markup_etag(self.post.body), etag)
+        self.assertIsNone(markup_etag(HashedPost(body=None).body))
+
+    def test_not_modified(self):
+        @condition(
+            etag_func=lambda request: markup_etag(
+                HashedPost.objects.only("pk", "_body_hash").get().body
+            )
+        )
+        def view(request):
+            return HttpResponse(str(HashedPost.objects.get().body))
+
+        response = view(RequestFactory().get("/"))
+        self.assertEqual(response.status_code, 200)
+        response = view(
+            RequestFactory().get("/", HTTP_IF_NONE_MATCH=response["ETag"])
+        )
+        self.assertEqual(response.status_code, 304)
+
+
+class MarkupSerializerTestCase(TestCase):
+    def setUp(self):
+        self.posts = [
+            VersionedPost.objects.create(body="text %d" % n) for n in range(3)
+        ]
+        SearchPost.objects.create(body="Some *searchable* text, long enough")
+        del RENDER_CALLS[:]
+
+    def dump(self, queryset):
+        return serializers.serialize("markupjsonl", queryset)
+
+    def load(self, data, **options):
+        objs = list(serializers.deserialize("markupjsonl", data, **options))
+        for obj in objs:
+            obj.save()
+        return objs
+
+    def test_payload(self):
+        lines = self.dump(VersionedPost.objects.order_by("pk")).splitlines()
+        self.assertEqual(len(lines), 3)
+        fields = json.loads(lines[0])["fields"]
+        self.assertEqual(
+            fields,
+            {
+                "body": {
+                    "raw": "text 0",
+                    "markup_type": "upper",
+                    "rendered": "TEXT 0",
+                    "hash": rendered_hash("TEXT 0"),
+                    "version": self.posts[0]._body_version,
+                }
+            },
+        )
+
+    def test_round_trip_without_rendering(self):
+        data = self.dump(VersionedPost.objects.all()) + self.dump(
+            SearchPost.objects.all()
+        )
+        VersionedPost.objects.all().delete()
+        SearchPost.objects.all().delete()
+        self.load(data)
+        self.assertEqual(RENDER_CALLS, [])
+        post = VersionedPost.objects.get(pk=self.posts[1].pk)
+        self.assertEqual(post.body.raw, "text 1")
+        self.assertEqual(post.body.rendered, "TEXT 1")
+        self.assertFalse(VersionedPost.objects.stale_markup().exists())
+        post = SearchPost.objects.get()
+        self.assertEqual(post.body.text, "Some searchable text, long enough")
+        self.assertEqual(post.body.excerpt, "Some searchable tex…")
+
+    def test_keeps_dumped_version(self):
+        data = self.dump(VersionedPost.objects.all())
+        VERSIONED_RENDERER.version = "2"
+        self.addCleanup(setattr, VERSIONED_RENDERER, "version", "1")
+        self.load(data)
+        self.assertEqual(RENDER_CALLS, [])
+        self.assertEqual(VersionedPost.objects.stale_markup().count(), 3)
+
+    def test_verify_hash(self):
+        data = self.dump(VersionedPost.objects.all()).replace("TEXT 1", "EDITED")
+        with self.assertRaisesMessage(DeserializationError, "doesn't match its hash"):
+            self.load(data)
+        self.load(data, verify_hash=False)
+        self.assertEqual(
+            VersionedPost.objects.get(pk=self.posts[1].pk).body.rendered, "EDITED"
+        )
+
+    def test_renders_missing_value(self):
+        # dumped before its deferred render ran
+        with self.captureOnCommitCallbacks():
+            post = DeferredPost.objects.create(body="pending")
+        data = self.dump(DeferredPost.objects.all())
+        self.assertEqual(json.loads(data)["fields"]["body"]["rendered"], None)
+        DeferredPost.objects.all().delete()
+        self.load(data)
+        self.assertEqual(RENDER_CALLS, ["pending"])
+        self.assertEqual(DeferredPost.objects.get(pk=post.pk)._body_rendered, "PENDING")
+
+    def test_streaming(self):
+        lines = iter(self.dump(VersionedPost.objects.order_by("pk")).splitlines())
+        objs = serializers.deserialize("markupjsonl", lines)
+        self.assertEqual(next(objs).object.body.raw, "text 0")
+        # the rest is still to be read
+        self.assertEqual(len(list(lines)), 2)
+
+    def test_dumpdata_loaddata(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = "%s/posts.markupjsonl" % directory
+            call_command(
+                "dumpdata", "tests.VersionedPost", format="markupjsonl", output=path
+            )
+            VersionedPost.objects.all().delete()
+            call_command("loaddata", path, verbosity=0)
+        self.assertEqual(VersionedPost.objects.count(), 3)
+        self.assertEqual(RENDER_CALLS, [])
+
+
+class ParallelRenderTestCase(TestCase):
+    def setUp(self):
+        del RENDER_CALLS[:]
+
+    def test_renders_at_the_same_time(self):
+        started = time.monotonic()
+        post = ParallelPost.objects.create(title="title", body="body", summary="summary")
+        # three renders of 0.2s each
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(sorted(RENDER_CALLS), ["body", "summary", "title"])
+        post = ParallelPost.objects.get()
+        self.assertEqual(
+            [post.title.rendered, post.body.rendered, post.summary.rendered],
+            ["TITLE", "BODY", "SUMMARY"],
+        )
+
+    def test_only_changed_fields(self):
+        post = ParallelPost.objects.create(title="title", body="body", summary="summary")
+        del RENDER_CALLS[:]
+        post.body = "changed"
+        post.save()
+        self.assertEqual(RENDER_CALLS, ["changed"])
+        post.title = "new title"
+        post.summary = "new summary"
+        post.save(update_fields=["title"])
+        self.assertEqual(RENDER_CALLS, ["changed", "new title"])
+
+    def test_errors_per_field(self):
+        post = ParallelPost(
+            title="title",
+            body="body",
+            body_markup_type="fail",
+            summary="summary",
+            summary_markup_type="unknown",
+        )
+        with self.assertRaises(MarkupRenderError) as cm:
+            post.save()
+        errors = cm.exception.errors
+        self.assertEqual(sorted(errors), ["body", "summary"])
+        self.assertEqual(str(errors["body"]), "cannot render body")
+        self.assertIsInstance(errors["summary"], ValueError)
+        self.assertEqual(ParallelPost.objects.count(), 0)
+        # the field that rendered is kept
+        self.assertEqual(post.title.rendered, "TITLE")
+
+    def test_executor(self):
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            post = ParallelPost(title="a", body="b", summary="c")
+            render_fields(post, ["title", "body"], executor)
+        self.assertEqual(sorted(RENDER_CALLS), ["a", "b"])
+        self.assertEqual(post._summary_rendered, "")
+
+
+class WarmupRenderer(Renderer):
+    warmup_markup = "warm"
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, markup):
+        self.calls.append(markup)
+        return markup
+
+
+class RendererRegistryTestCase(TestCase):
+    def tearDown(self):
+        renderers.reset()
+
+    def test_types_from_settings(self):
+        self.assertEqual(
+            [name for name, _, _ in renderers.choices()], ["markdown", "ReST", "plain"]
+        )
+        # 2-tuples are titled by their name
+        self.assertEqual(renderers.choices(["plain"])[0][2], "plain")
+        with override_settings(MARKUP_FIELD_TYPES=DEFAULT_MARKUP_TYPES[:1]):
+            self.assertEqual(list(renderers.get_types()), ["html"])
+        self.assertIn("ReST", renderers)
+
+    def test_register(self):
+        renderer = WarmupRenderer()
+        renderers.register("echo", renderer, "Echo")
+        renderers.unregister("ReST")
+        self.assertEqual(renderers.get("echo"), renderer)
+        self.assertNotIn("ReST", renderers)
+        with self.assertRaises(KeyError):
+            renderers.unregister("ReST")
+
+        field = MarkupField()
+        self.assertEqual(field.markup_choices_list, ["markdown", "plain", "echo"])
+        self.assertEqual(field.markup_choices_title[-1], "Echo")
+        renderers.reset()
+        self.assertNotIn("echo", renderers)
+
+    def test_fields_share_renderers(self):
+        first, second = MarkupField(), MarkupField()
+        self.assertIs(
+            first.markup_choices_dict["plain"], second.markup_choices_dict["plain"]
+        )
+        # registered types by name
+        field = MarkupField(markup_choices=["plain", ("upper", counting_render)])
+        self.assertEqual(field.markup_choices_list, ["plain", "upper"])
+        self.assertIs(field.markup_choices_dict["plain"], renderers.get("plain"))
+        with self.assertRaises(KeyError):
+            MarkupField(markup_choices=["textile"])
+
+    def test_warmup_renderer(self):
+        renderer = WarmupRenderer()
+        lazy = LazyRenderer("lazy", lambda: renderer)
+        lazy.warmup()
+        self.assertEqual(renderer.calls, ["warm"])
+        # markup engines are imported and set up
+        for renderer in [MarkdownRenderer(), RestRenderer()]:
+            renderer.warmup()
+            self.assertIsNotNone(renderer.version)
+
+    def test_warmup(self):
+        renderer = WarmupRenderer()
+        renderers.register("echo", renderer)
+        renderers.register("echo again", renderer)
+        results = warmup()
+        self.assertEqual(renderer.calls, ["warm"])
+        names = [name for name, _, _ in results]
+        self.assertIn("echo", names)
+        self.assertNotIn("echo again", names)
+        # renderers of fields with their own choices
+        self.assertIn("slow", names)
+        self.assertTrue(all(seconds >= 0 for _, _, seconds in results))
+
+    def test_warmup_on_ready(self):
+        renderer = WarmupRenderer()
+        renderers.register("echo", renderer)
+        config = apps.get_app_config("markupfield")
+        config.ready()
+        self.assertEqual(renderer.calls, [])
+        with override_settings(MARKUP_FIELD_WARMUP=True):
+            config.ready()
+        self.assertEqual(renderer.calls, ["warm"])
+
+    def test_command(self):
+        renderers.register("echo", WarmupRenderer())
+        out = StringIO()
+        call_command("warmup_markup", stdout=out)
+        self.assertIn("echo", out.getvalue())
+        self.assertIn(" ms ", out.getvalue())
+
+
+@override_settings(ROOT_URLCONF="markupfield.tests.urls")
+class PreviewTestCase(TestCase):
+    def setUp(self):
+        del RENDER_CALLS[:]
+        get_preview_cache().clear()
+
+    def preview(self, user=True, perms=("tests.change_previewpost",), **data):
+        request = RequestFactory().post("/markupfield/preview/", data)
+        if user is not None:
+            request.user = types.SimpleNamespace(
+                is_authenticated=user, has_perm=lambda perm: perm in perms
+            )
+        response = preview(request)
+        return response.status_code, json.loads(response.content)
+
+    def test_preview(self):
+        self.assertEqual(
+            self.preview(field="tests.PreviewPost.body", text="*hi*"),
+            (200, {"rendered": "*HI*"}),
+        )
+        status, result = self.preview(
+            field="tests.PreviewPost.body", markup_type="plain", text="a <b>"
+        )
+        self.assertEqual(result["rendered"], "<p>a &lt;b&gt;</p>")
+        # the markup type of fields with a fixed one can't be changed
+        status, result = self.preview(
+            field="tests.PreviewPost.fixed", markup_type="upper", text="hi"
+        )
+        self.assertEqual(result["rendered"], "<p>hi</p>")
+
+    def test_cached(self):
+        for _ in range(3):
+            self.preview(field="tests.PreviewPost.body", text="cached")
+        self.preview(field="tests.PreviewPost.body", text="other")
+        self.assertEqual(RENDER_CALLS, ["cached", "other"])
+
+    def test_refused(self):
+        self.assertEqual(
+            self.preview(user=False, field="tests.PreviewPost.body", text="hi")[0], 403
+        )
+        self.assertEqual(
+            self.preview(user=None, field="tests.PreviewPost.body", text="hi")[0], 403
+        )
+        # site users who can't edit the model
+        self.assertEqual(
+            self.preview(perms=(), field="tests.PreviewPost.body", text="hi")[0], 403
+        )
+        self.assertEqual(
+            self.preview(
+                perms=("tests.change_post",), field="tests.PreviewPost.body", text="hi"
+            )[0],
+            403,
+        )
+        self.assertEqual(
+            self.preview(
+                perms=("tests.add_previewpost",), field="tests.PreviewPost.body"
+            )[0],
+            200,
+        )
+        for field in [
+            "tests.PreviewPost.no_preview",
+            "tests.PreviewPost.id",
+            "tests.PreviewPost.missing",
+            "tests.Missing.body",
+            "body",
+        ]:
+            self.assertEqual(self.preview(field=field, text="hi")[0], 400)
+        self.assertEqual(
+            self.preview(field="tests.PreviewPost.body", markup_type="ReST")[0], 400
+        )
+        with override_settings(MARKUP_FIELD_PREVIEW_MAX_LENGTH=5):
+            self.assertEqual(
+                self.preview(field="tests.PreviewPost.body", text="123456")[0], 413
+            )
+            self.assertEqual(
+                self.preview(field="tests.PreviewPost.body", text="12345")[0], 200
+            )
+        self.assertEqual(RENDER_CALLS, ["", "12345"])
+        response = self.client.get("/markupfield/preview/")
+        self.assertEqual(response.status_code, 405)
+
+    def test_widget(self):
+        form = modelform_factory(PreviewPost, fields=["body", "body_markup_type"])()
+        widget = form.fields["body"].widget
+        self.assertIsInstance(widget, MarkupTextarea)
+        self.assertEqual(widget.preview_field, "tests.PreviewPost.body")
+        self.assertIn("markupfield/preview.js", str(form.media))
+        html = str(form["body"])
+        self.assertIn('data-markupfield-preview="/markupfield/preview/"', html)
+        self.assertIn('data-markupfield-field="tests.PreviewPost.body"', html)
+        self.assertIn('data-markupfield-markup-type="body_markup_type"', html)
+
+        form = modelform_factory(PreviewPost, fields=["no_preview"])()
+        self.assertNotIn("data-markupfield", str(form["no_preview"]))
+        self.assertEqual(str(form.media), "")
+
+    def test_admin_widget(self):
+        from django.contrib import admin
+
+        ma = admin.ModelAdmin(PreviewPost, admin.site)
+        widget = ma.formfield_for_dbfield(
+            PreviewPost._meta.get_field("body"), request=None
+        ).widget
+        self.assertIsInstance(widget, AdminMarkupTextareaWidget)
+        self.assertEqual(widget.preview_field, "tests.PreviewPost.body")
+        self.assertIn("vLargeTextField", widget.attrs["class"])
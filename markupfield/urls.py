@@ -0,0 +1,9 @@
+from django.urls import path
+
+from markupfield import views
+
+app_name = "markupfield"
+
+urlpatterns = [
+    path("preview/", views.preview, name="preview"),
+]
@@ -0,0 +1,95 @@
+import hashlib
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_permission_codename
+from django.core.exceptions import FieldDoesNotExist
+from django.http import JsonResponse
+from django.views.decorators.http import require_POST
+
+from markupfield.cache import get_preview_cache
+from markupfield.fields import MarkupField
+
+# default limit of previewed text in characters
+DEFAULT_PREVIEW_MAX_LENGTH = 100000
+
+
+def markup_etag(*markups):
+    """
+    Return a strong ETag for a response built from the rendered values of
+    ``markups``, or ``None`` if one of them hasn't been rendered.  Pass it to
+    ``django.views.decorators.http.condition`` as the ``etag_func`` result.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for markup in markups:
+        fingerprint = markup.fingerprint
+        if fingerprint is None:
+            return None
+        digest.update(fingerprint.encode("utf-8"))
+        digest.update(b"\0")
+    return '"%s"' % digest.hexdigest()
+
+
+def _get_preview_field(label):
+    try:
+        model_label, field_name = label.rsplit(".", 1)
+        field = apps.get_model(model_label)._meta.get_field(field_name)
+    except (ValueError, LookupError, FieldDoesNotExist):
+        return None
+    if isinstance(field, MarkupField) and field.preview:
+        return field
+    return None
+
+
+def _can_preview(user, model):
+    # editors of the model, as in the admin
+    opts = model._meta
+    return any(
+        user.has_perm("%s.%s" % (opts.app_label, get_permission_codename(action, opts)))
+        for action in ("add", "change")
+    )
+
+
+@require_POST
+def preview(request):
+    """
+    Render the POSTed ``text`` like the MarkupField named by ``field``
+    (``app_label.ModelName.field``, a field with ``preview``) renders it for
+    ``markup_type`` and return ``{"rendered": ...}``, for users allowed to
+    add or change objects of the field's model.
+
+    Nothing is read from or written to the database.  Previews are kept in
+    an in-process LRU cache keyed by the text's hash, texts longer than
+    ``MARKUP_FIELD_PREVIEW_MAX_LENGTH`` characters are refused.
+    """
+    user = getattr(request, "user", None)
+    if user is None or not user.is_authenticated:
+        return JsonResponse({"error": "Authentication required."}, status=403)
+    field = _get_preview_field(request.POST.get("field", ""))
+    if field is None:
+        return JsonResponse({"error": "Unknown MarkupField."}, status=400)
+    if not _can_preview(user, field.model):
+        return JsonResponse({"error": "Permission denied."}, status=403)
+    markup_type = field.default_markup_type
+    if field.markup_type_editable:
+        markup_type = request.POST.get("markup_type") or markup_type
+    if markup_type not in field.markup_choices_list:
+        return JsonResponse({"error": "Invalid markup type."}, status=400)
+    text = request.POST.get("text", "")
+    max_length = getattr(
+        settings, "MARKUP_FIELD_PREVIEW_MAX_LENGTH", DEFAULT_PREVIEW_MAX_LENGTH
+    )
+    if len(text) > max_length:
+        return JsonResponse(
+            {"error": "Text longer than %d characters." % max_length}, status=413
+        )
+
+    cache = get_preview_cache()
+    key = (field.model._meta.label, field.name) + cache.make_key(
+        markup_type, field.escape_html, field.markup_choices_dict[markup_type], text
+    )
+    rendered = cache.get(key)
+    if rendered is None:
+        rendered = field.render_markup(text, markup_type)
+        cache.set(key, rendered)
+    return JsonResponse({"rendered": rendered})
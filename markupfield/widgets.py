@@ -1,8 +1,37 @@
 from django import forms
 from django.contrib.admin.widgets import AdminTextareaWidget
+from django.urls import reverse
 
 
 class MarkupTextarea(forms.widgets.Textarea):
+    """
+    Textarea editing the raw value of a MarkupField.  With ``preview_field``,
+    the label of a MarkupField with ``preview`` (``app_label.ModelName.field``),
+    it shows a live preview rendered by ``markupfield.views.preview``.
+    """
+
+    def __init__(self, attrs=None, preview_field=None):
+        super(MarkupTextarea, self).__init__(attrs)
+        self.preview_field = preview_field
+
+    @property
+    def media(self):
+        if self.preview_field is None:
+            return forms.Media()
+        return forms.Media(js=["markupfield/preview.js"])
+
+    def get_context(self, name, value, attrs):
+        context = super(MarkupTextarea, self).get_context(name, value, attrs)
+        if self.preview_field is not None:
+            context["widget"]["attrs"].update(
+                {
+                    "data-markupfield-preview": reverse("markupfield:preview"),
+                    "data-markupfield-field": self.preview_field,
+                    "data-markupfield-markup-type": name + "_markup_type",
+                }
+            )
+        return context
+
     def render(self, name, value, attrs=None, renderer=None):
         if hasattr(value, "raw"):
             value = value.raw